@@ -0,0 +1,185 @@
+import asyncio
+import copy
+import datetime
+import itertools
+import threading
+import time
+import uuid
+
+# README test users (phone -> document, name); the documents end with the README's 3 validation digits.
+TEST_USERS = [
+    {"phone_number": "3199887766", "document_number": "1045678321", "full_name": "Ana Martínez"},
+    {"phone_number": "3211223344", "document_number": "1098765789", "full_name": "Carlos López"},
+    {"phone_number": "3168765431", "document_number": "52123321", "full_name": "María García"},
+    {"phone_number": "3112345678", "document_number": "80345678", "full_name": "Juan Pérez"},
+]
+
+
+class FakeAPIError(Exception):
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class InMemoryDatabase:
+    # Tables for users, conversations, messages and tickets. Every execute() is one "round-trip".
+    def __init__(self, latency_seconds=0.0):
+        self.latency_seconds = latency_seconds
+        self.tables = {"users": copy.deepcopy(TEST_USERS), "conversations": [], "messages": [], "tickets": []}
+        self.unique = {"tickets": [("ticket_number",), ("conversation_id", "phone_number")], "users": [("phone_number",)]}
+        self.round_trips = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def reset_counters(self):
+        with self._lock:
+            self.round_trips = 0
+
+    def _now(self):
+        return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    def execute(self, query):
+        with self._lock:
+            self.round_trips += 1
+            rows = self.tables.setdefault(query.table, [])
+            if query.operation == "insert":
+                return FakeResponse(self._insert(query.table, rows, query.payload))
+            if query.operation == "upsert":
+                return FakeResponse(self._insert(query.table, rows, query.payload, on_conflict=query.on_conflict))
+            matched = [row for row in rows if all(check(row) for check in query.filters)]
+            if query.operation == "update":
+                for row in matched:
+                    row.update({k: (self._now() if v == "now()" else v) for k, v in query.payload.items()})
+                return FakeResponse(copy.deepcopy(matched))
+            if query.operation == "delete":
+                self.tables[query.table] = [row for row in rows if row not in matched]
+                return FakeResponse(copy.deepcopy(matched))
+            for column, desc in reversed(query.orders):
+                matched.sort(key=lambda row: str(row.get(column) or ""), reverse=desc)
+            if query.limit_count is not None:
+                matched = matched[:query.limit_count]
+            data = [self._project(row, query.columns) for row in matched]
+            if query.single_row:
+                if len(data) != 1:
+                    raise FakeAPIError("JSON object requested, multiple (or no) rows returned", "PGRST116")
+                return FakeResponse(data[0])
+            return FakeResponse(data)
+
+    def _insert(self, table, rows, payload, on_conflict=None):
+        inserted = []
+        for new_row in payload if isinstance(payload, list) else [payload]:
+            row = {"id": str(next(self._ids)), "created_at": self._now()}
+            if table == "conversations":
+                row["updated_at"] = row["created_at"]
+            row.update(new_row)
+            if on_conflict:
+                keys = [k.strip() for k in on_conflict.split(",")]
+                existing = next((r for r in rows if all(r.get(k) == row.get(k) for k in keys)), None)
+                if existing is not None:
+                    continue
+            for columns in self.unique.get(table, []):
+                if any(all(r.get(c) == row.get(c) for c in columns) for r in rows + inserted):
+                    raise FakeAPIError(f"duplicate key value violates unique constraint ({', '.join(columns)})", "23505")
+            inserted.append(row)
+        rows.extend(inserted)
+        return copy.deepcopy(inserted)
+
+    def _project(self, row, columns):
+        if columns in (None, "*"):
+            return copy.deepcopy(row)
+        return {c.strip(): row.get(c.strip()) for c in columns.split(",")}
+
+
+class FakeQuery:
+    def __init__(self, db, table, is_async):
+        self.db = db
+        self.table = table
+        self.is_async = is_async
+        self.operation = "select"
+        self.columns = "*"
+        self.payload = None
+        self.on_conflict = None
+        self.filters = []
+        self.orders = []
+        self.limit_count = None
+        self.single_row = False
+
+    def select(self, columns="*", **kwargs):
+        self.operation, self.columns = "select", columns
+        return self
+
+    def insert(self, payload, **kwargs):
+        self.operation, self.payload = "insert", payload
+        return self
+
+    def upsert(self, payload, on_conflict=None, ignore_duplicates=False, **kwargs):
+        self.operation, self.payload, self.on_conflict = "upsert", payload, on_conflict
+        return self
+
+    def update(self, payload, **kwargs):
+        self.operation, self.payload = "update", payload
+        return self
+
+    def delete(self, **kwargs):
+        self.operation = "delete"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        values = list(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) < str(value))
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: str(row.get(column)) > str(value))
+        return self
+
+    def order(self, column, desc=False, **kwargs):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def single(self):
+        self.single_row = True
+        return self
+
+    def execute(self):
+        if self.is_async:
+            return self._execute_async()
+        if self.db.latency_seconds:
+            time.sleep(self.db.latency_seconds)
+        return self.db.execute(self)
+
+    async def _execute_async(self):
+        if self.db.latency_seconds:
+            await asyncio.sleep(self.db.latency_seconds)
+        return self.db.execute(self)
+
+
+class FakeSupabase:
+    # Covers the subset of the supabase-py query builder used by chat_utils and data_access.
+    def __init__(self, db, is_async=False):
+        self.db = db
+        self.is_async = is_async
+
+    def table(self, name):
+        return FakeQuery(self.db, name, self.is_async)
+
+
+def new_session_id():
+    return f"bench-{uuid.uuid4().hex[:12]}"
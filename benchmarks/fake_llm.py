@@ -0,0 +1,75 @@
+import re
+import threading
+import time
+
+from state_engine import (
+    REPLY_ASK_PHONE, REPLY_TELCOID_OK, REPLY_TELCOID_ERROR, REPLY_VALIDATION_OK,
+    REPLY_VALIDATION_ERROR, REPLY_TICKET_OK, REPLY_TICKET_ERROR,
+    extract_phone, extract_document_digits, is_confirmation, wrap_reply, wrap_command,
+)
+
+TELCOID_OK_PATTERN = re.compile(r"OK_TELCOID:DOC:(.*?):NOMBRE:([^|\n]*)")
+TICKET_OK_PATTERN = re.compile(r"OK_TICKET:TICKET:(\S+)")
+PHONE_COMMAND_PATTERN = re.compile(r"VALIDAR_TELCOID:(\d{10})")
+
+
+class FakeLLM:
+    # Replays the scripted SYSTEM_PROMPT responses for each state, with configurable latency:
+    # time to first token, then a delay per streamed chunk.
+    def __init__(self, ttfb_seconds=0.3, chunk_delay_seconds=0.01, chunk_size=12):
+        self.ttfb_seconds = ttfb_seconds
+        self.chunk_delay_seconds = chunk_delay_seconds
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls = 0
+
+    def respond(self, messages):
+        last = messages[-1]["content"]
+        history = "\n".join(m["content"] for m in messages)
+        if last.startswith("OK_TELCOID"):
+            return wrap_reply(REPLY_TELCOID_OK.format(name=TELCOID_OK_PATTERN.search(last).group(2).strip()))
+        if last.startswith("ERROR_TELCOID"):
+            return wrap_reply(REPLY_TELCOID_ERROR)
+        if last.startswith("OK_VALIDACION"):
+            return wrap_reply(REPLY_VALIDATION_OK)
+        if last.startswith("ERROR_VALIDACION"):
+            return wrap_reply(REPLY_VALIDATION_ERROR)
+        if last.startswith("OK_TICKET"):
+            return wrap_reply(REPLY_TICKET_OK.format(ticket=TICKET_OK_PATTERN.search(last).group(1)))
+        if last.startswith("ERROR_TICKET"):
+            return wrap_reply(REPLY_TICKET_ERROR)
+
+        phone = extract_phone(last)
+        if phone:
+            return wrap_command(f"VALIDAR_TELCOID:{phone}")
+        known_phones = PHONE_COMMAND_PATTERN.findall(history)
+        digits = extract_document_digits(last)
+        if digits and known_phones:
+            return wrap_command(f"VALIDAR_DOCUMENTO:{known_phones[-1]}:{digits}")
+        facts = TELCOID_OK_PATTERN.findall(history)
+        if is_confirmation(last) and known_phones and facts:
+            document, name = facts[-1]
+            return wrap_command(f"GENERAR_TICKET:{known_phones[-1]}:{document}:{name.strip()}:perdida")
+        return wrap_reply(REPLY_ASK_PHONE)
+
+    # Same signatures as chat_utils._get_llm_response_base / _stream_llm_response_base.
+    def complete(self, model_provider, messages, api_key):
+        with self._lock:
+            self.calls += 1
+        text = self.respond(messages)
+        time.sleep(self.ttfb_seconds + self.chunk_delay_seconds * (len(text) // self.chunk_size))
+        return text
+
+    def stream(self, model_provider, messages, api_key):
+        with self._lock:
+            self.calls += 1
+        text = self.respond(messages)
+        time.sleep(self.ttfb_seconds)
+        for start in range(0, len(text), self.chunk_size):
+            if start:
+                time.sleep(self.chunk_delay_seconds)
+            yield text[start:start + self.chunk_size]
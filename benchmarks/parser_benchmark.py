@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import chat_utils  # noqa: F401  registers the command handlers, so typed arguments are parsed too
+from command_parser import parse_response, extract_conversational_response
+from fake_backend import TEST_USERS
+from state_engine import (
+    REPLY_ASK_PHONE, REPLY_TELCOID_OK, REPLY_TELCOID_ERROR, REPLY_VALIDATION_OK,
+    REPLY_VALIDATION_ERROR, REPLY_TICKET_OK, REPLY_TICKET_ERROR, wrap_reply, wrap_command,
+)
+
+
+def build_corpus(size, seed=7):
+    # Synthetic recording of the flow's responses: replies, the three commands (valid and
+    # malformed), truncated tags and untagged text, in roughly the mix a conversation produces.
+    rng = random.Random(seed)
+    samples = []
+    while len(samples) < size:
+        user = rng.choice(TEST_USERS)
+        phone, document, name = user["phone_number"], user["document_number"], user["full_name"]
+        samples.extend([
+            wrap_reply(REPLY_ASK_PHONE),
+            wrap_command(f"VALIDAR_TELCOID:{phone}"),
+            wrap_reply(REPLY_TELCOID_OK.format(name=name)),
+            wrap_reply(REPLY_TELCOID_ERROR),
+            wrap_command(f"VALIDAR_DOCUMENTO:{phone}:{document[-3:]}"),
+            wrap_reply(REPLY_VALIDATION_OK),
+            wrap_reply(REPLY_VALIDATION_ERROR),
+            wrap_command(f"GENERAR_TICKET:{phone}:{document}:{name}:perdida"),
+            wrap_reply(REPLY_TICKET_OK.format(ticket=f"TEL-20260101-{rng.randint(0, 10 ** 9):X}")),
+            wrap_reply(REPLY_TICKET_ERROR),
+            wrap_command(f"GENERAR_TICKET:{phone}:{document}"),
+            wrap_reply(REPLY_ASK_PHONE)[:40],
+            "Respuesta sin etiquetas del modelo.",
+        ])
+    return samples[:size]
+
+
+def load_corpus(path):
+    # JSONL with a "content" field per line (e.g. an export of the messages table).
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["content"] for line in f if line.strip()]
+
+
+def legacy_parse(text):
+    # The previous process_llm_command / extract_conversational_response path, for comparison.
+    command_match = re.search(r'<comando_interno>(.*?)</comando_interno>', text, re.DOTALL)
+    if command_match:
+        command = command_match.group(1).strip()
+        if re.match(r'VALIDAR_TELCOID\s*:\s*(\d{10,})', command, re.IGNORECASE):
+            return command
+        if re.match(r'VALIDAR_DOCUMENTO\s*:\s*(\d{10,})\s*:\s*(\d{3,})', command, re.IGNORECASE):
+            return command
+        if re.match(r'GENERAR_TICKET\s*:', command, re.IGNORECASE):
+            return command.split(":", 4)
+        return None
+    match = re.search(r"<respuesta_conversacional>(.*?)</respuesta_conversacional>", text, re.DOTALL)
+    return match.group(1).strip() if match else text
+
+
+def measure(function, corpus, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            function(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {"total_ms": round(best * 1000, 2), "ns_per_message": round(best / len(corpus) * 1e9, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark del parser de etiquetas y comandos.")
+    parser.add_argument("--size", type=int, default=100000, help="Tamaño del corpus sintético.")
+    parser.add_argument("--corpus", help="JSONL con respuestas grabadas (campo content); reemplaza el corpus sintético.")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones; se reporta la mejor.")
+    parser.add_argument("--output", help="Archivo JSON donde se guardan los resultados.")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else build_corpus(args.size)
+    kinds = {}
+    for text in corpus:
+        kind = parse_response(text).kind
+        kinds[kind] = kinds.get(kind, 0) + 1
+
+    report = {
+        "messages": len(corpus),
+        "kinds": kinds,
+        "parse_response": measure(parse_response, corpus, args.repeat),
+        "extract_conversational_response": measure(extract_conversational_response, corpus, args.repeat),
+        "legacy_regex": measure(legacy_parse, corpus, args.repeat),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Must be set before data_access is imported: the benchmark never touches the real write journal.
+os.environ.setdefault("DB_WRITE_JOURNAL_DIR", os.path.join(tempfile.gettempdir(), "telcobot_bench_journal"))
+os.environ.setdefault("TICKET_NODE_ID", "0")  # No node lease against the in-memory DB.
+
+from fake_backend import InMemoryDatabase, FakeSupabase, TEST_USERS, new_session_id
+from fake_llm import FakeLLM
+
+UNKNOWN_PHONE = "3000000000"
+COMPARED_METRICS = {
+    # metric -> True when higher is better
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "throughput_turns_per_s": True,
+    "db_round_trips_per_turn": False,
+    "llm_calls_per_turn": False,
+}
+
+
+def build_scenarios():
+    scenarios = []
+    for user in TEST_USERS:
+        phone, digits, name = user["phone_number"], user["document_number"][-3:], user["full_name"]
+        scenarios.append((f"ok:{name}", ["Hola, quiero bloquear mi línea", phone, f"son {digits}", "Sí, confirmo"]))
+    user = TEST_USERS[0]
+    phone, digits = user["phone_number"], user["document_number"][-3:]
+    scenarios.append(("error:telefono_no_registrado", ["Me robaron el celular, quiero bloquear la línea", UNKNOWN_PHONE, phone, digits, "Sí, confirmo"]))
+    scenarios.append(("error:digitos_incorrectos", ["Perdí mi teléfono", phone, "son 000", f"son {digits}", "Sí, proceder"]))
+    return scenarios
+
+
+def install_fakes(db, llm):
+    import chat_utils
+    import data_access
+
+    async def create_fake_async_supabase():
+        return FakeSupabase(db, is_async=True)
+
+    fake_supabase = FakeSupabase(db)
+    chat_utils.get_supabase = lambda: fake_supabase
+    data_access.create_async_supabase = create_fake_async_supabase
+    chat_utils._get_llm_response_base = llm.complete
+    chat_utils._stream_llm_response_base = llm.stream
+
+
+def run_session(conversation_id, scenario, provider, fast_path, latencies, lock):
+    from chat_turn import run_chat_turn, DEFAULT_CONVERSATION_TITLE
+    from state_engine import FlowState
+
+    name, prompts = scenario
+    messages, flow = [], FlowState()
+    title = DEFAULT_CONVERSATION_TITLE
+    result = None
+    for prompt in prompts:
+        start = time.perf_counter()
+        result = run_chat_turn(conversation_id, messages, prompt, "bench-api-key", provider, flow,
+                               fast_path_enabled=fast_path, conversation_title=title)
+        elapsed = time.perf_counter() - start
+        title = result.new_title or title
+        with lock:
+            latencies.append(elapsed)
+    return name, bool(result and result.ticket_created)
+
+
+def run_level(sessions, rounds, scenarios, provider, fast_path, db, llm):
+    from chat_utils import create_conversation
+
+    plan = []
+    for session in range(sessions):
+        for round_number in range(rounds):
+            conversation = create_conversation(new_session_id())
+            plan.append((conversation["id"], scenarios[(session + round_number) % len(scenarios)]))
+    # Conversation setup isn't part of a turn.
+    db.reset_counters()
+    llm.reset_counters()
+
+    latencies, lock = [], threading.Lock()
+    outcomes = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        # Each worker is one session running its conversations back to back.
+        per_session = [plan[i::sessions] for i in range(sessions)]
+        futures = [pool.submit(lambda items: [run_session(c, s, provider, fast_path, latencies, lock) for c, s in items], items) for items in per_session]
+        for future in futures:
+            outcomes.extend(future.result())
+    wall = time.perf_counter() - start
+
+    turns = len(latencies)
+    cuts = statistics.quantiles(latencies, n=100) if turns > 1 else [latencies[0] if latencies else 0.0] * 99
+    return {
+        "sessions": sessions,
+        "conversations": len(plan),
+        "turns": turns,
+        "p50_ms": round(cuts[49] * 1000, 2),
+        "p95_ms": round(cuts[94] * 1000, 2),
+        "p99_ms": round(cuts[98] * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if turns else 0.0,
+        "throughput_turns_per_s": round(turns / wall, 2) if wall else 0.0,
+        "db_round_trips_per_turn": round(db.round_trips / turns, 2) if turns else 0.0,
+        "llm_calls_per_turn": round(llm.calls / turns, 2) if turns else 0.0,
+        "tickets_expected": len(plan),
+        "tickets_created": sum(1 for _, created in outcomes if created),
+    }
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    baseline_levels = {level["sessions"]: level for level in baseline["results"]}
+    regressions = []
+    for level in results:
+        old = baseline_levels.get(level["sessions"])
+        if not old:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            before, after = old.get(metric), level.get(metric)
+            if not before:
+                continue
+            change = (after - before) / before
+            worse = change < -threshold if higher_is_better else change > threshold
+            flag = "  <-- REGRESIÓN" if worse else ""
+            print(f"[{level['sessions']:>3} sesiones] {metric:<26} {before:>10} -> {after:>10} ({change:+.1%}){flag}")
+            if worse:
+                regressions.append((level["sessions"], metric))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark headless del turno de chat con Supabase y LLM simulados.")
+    parser.add_argument("--sessions", default="1,8", help="Niveles de concurrencia separados por coma (sesiones simultáneas).")
+    parser.add_argument("--rounds", type=int, default=3, help="Conversaciones completas por sesión.")
+    parser.add_argument("--provider", default="gemini", choices=["gemini", "openai"])
+    parser.add_argument("--no-fast-path", action="store_true", help="Desactiva la ruta rápida (todas las respuestas pasan por el LLM).")
+    parser.add_argument("--llm-ttfb", type=float, default=0.3, help="Latencia hasta el primer token del LLM simulado (s).")
+    parser.add_argument("--llm-chunk-delay", type=float, default=0.01, help="Latencia entre fragmentos del LLM simulado (s).")
+    parser.add_argument("--db-latency", type=float, default=0.02, help="Latencia por ida y vuelta a la base simulada (s).")
+    parser.add_argument("--output", default="bench_output.json", help="Archivo JSON donde se guardan los resultados.")
+    parser.add_argument("--compare", help="Resultados previos (JSON) contra los que comparar.")
+    parser.add_argument("--regression-threshold", type=float, default=0.10, help="Variación relativa que se considera regresión.")
+    args = parser.parse_args()
+
+    # The error scenarios log expected failures (to stderr); keep the report readable.
+    logging.basicConfig(level=os.getenv("TELCOBOT_LOG_LEVEL", "CRITICAL"))
+    db = InMemoryDatabase(latency_seconds=args.db_latency)
+    llm = FakeLLM(ttfb_seconds=args.llm_ttfb, chunk_delay_seconds=args.llm_chunk_delay)
+    install_fakes(db, llm)
+    scenarios = build_scenarios()
+
+    results = []
+    for sessions in [int(level) for level in args.sessions.split(",")]:
+        level = run_level(sessions, args.rounds, scenarios, args.provider, not args.no_fast_path, db, llm)
+        results.append(level)
+        print(json.dumps(level, ensure_ascii=False))
+
+    report = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "scenarios": [name for name, _ in scenarios],
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.regression_threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
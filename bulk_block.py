@@ -0,0 +1,165 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import re
+import sys
+import uuid
+
+from chat_utils import (
+    create_conversation, get_users_by_phones, document_matches, create_tickets_bulk
+)
+
+# Bloqueo masivo de líneas sin LLM: misma lógica de backend que los comandos internos
+# (VALIDAR_TELCOID, VALIDAR_DOCUMENTO, GENERAR_TICKET), pero por lotes.
+DEFAULT_CHUNK_SIZE = int(os.getenv("BULK_BLOCK_CHUNK_SIZE", "200"))
+DEFAULT_REASON = "perdida"
+PHONE_PATTERN = re.compile(r"^\d{10,}$")
+DIGITS_PATTERN = re.compile(r"^\d{3,}$")
+
+
+def read_requests(path):
+    # CSV con encabezado o JSONL, con los campos phone_number, document_digits y reason (opcional).
+    # Cada fila conserva su número (desde 1) para poder reanudar.
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith((".jsonl", ".json")):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for number, row in enumerate(rows, start=1):
+            yield number, {k.strip(): str(v or "").strip() for k, v in row.items() if k}
+
+
+def load_progress(output_path):
+    # Devuelve (conversation_id, filas ya procesadas). Una última línea incompleta (interrupción
+    # a mitad de escritura) se descarta para que la fila se vuelva a procesar.
+    if not os.path.exists(output_path):
+        return None, set()
+    with open(output_path, "rb") as f:
+        data = f.read()
+    if data and not data.endswith(b"\n"):
+        data = data[:data.rfind(b"\n") + 1]
+        with open(output_path, "wb") as f:
+            f.write(data)
+    conversation_id, done = None, set()
+    for line in data.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        if "run" in entry:
+            conversation_id = entry["run"]["conversation_id"]
+        else:
+            done.add(entry["row"])
+    return conversation_id, done
+
+
+def validate_request(row):
+    phone = row.get("phone_number", "")
+    digits = row.get("document_digits", "")
+    if not PHONE_PATTERN.match(phone):
+        return "Número de teléfono inválido."
+    if not DIGITS_PATTERN.match(digits):
+        return "Dígitos del documento inválidos."
+    return None
+
+
+def process_chunk(conversation_id, chunk):
+    # chunk: [(row_number, row)]. Una consulta in_() de usuarios y un insert masivo de tickets
+    # por bloque; devuelve los resultados en el orden de entrada.
+    results, valid = {}, []
+    for number, row in chunk:
+        error = validate_request(row)
+        if error:
+            results[number] = {"status": "ERROR_ENTRADA", "detail": error}
+        else:
+            valid.append((number, row))
+
+    users = get_users_by_phones([row["phone_number"] for _, row in valid])
+    to_create = []
+    for number, row in valid:
+        user = users.get(row["phone_number"])
+        if not user:
+            results[number] = {"status": "ERROR_TELCOID", "detail": "El número no está registrado."}
+        elif not document_matches(user, row["document_digits"]):
+            results[number] = {"status": "ERROR_VALIDACION", "detail": "Los dígitos no coinciden."}
+        else:
+            to_create.append((number, row, user))
+
+    tickets = create_tickets_bulk(conversation_id, [{
+        "phone_number": row["phone_number"],
+        "document_number": user["document_number"],
+        "user_name": user["full_name"],
+        "block_reason": row.get("reason") or DEFAULT_REASON,
+    } for _, row, user in to_create])
+    for number, row, _ in to_create:
+        ticket = tickets.get(row["phone_number"])
+        if ticket:
+            results[number] = {"status": "OK_TICKET", "ticket_number": ticket["ticket_number"]}
+        else:
+            results[number] = {"status": "ERROR_TICKET", "detail": "Error al guardar el ticket en la base de datos."}
+
+    return [dict({"row": number, "phone_number": row.get("phone_number", "")}, **results[number]) for number, row in chunk]
+
+
+def run(input_path, output_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    conversation_id, done = load_progress(output_path)
+    counts = {}
+    with open(output_path, "a", encoding="utf-8") as out:
+        if conversation_id is None:
+            # Todos los tickets del lote cuelgan de una conversación propia: la restricción
+            # (conversation_id, phone_number) evita duplicados al reanudar.
+            conversation = create_conversation(f"bulk-{uuid.uuid4().hex[:12]}", title=f"Bloqueo masivo: {os.path.basename(input_path)}")
+            if not conversation:
+                raise RuntimeError("No se pudo crear la conversación del lote.")
+            conversation_id = conversation["id"]
+            out.write(json.dumps({"run": {
+                "conversation_id": conversation_id,
+                "input": os.path.abspath(input_path),
+                "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            }}, ensure_ascii=False) + "\n")
+            # En disco antes del primer insert: sin la cabecera, una reanudación crearía otra
+            # conversación y volvería a insertar todos los tickets.
+            out.flush()
+            os.fsync(out.fileno())
+
+        def write(results):
+            for result in results:
+                counts[result["status"]] = counts.get(result["status"], 0) + 1
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+
+        chunk = []
+        for number, row in read_requests(input_path):
+            if number in done:
+                continue
+            chunk.append((number, row))
+            if len(chunk) >= chunk_size:
+                write(process_chunk(conversation_id, chunk))
+                chunk = []
+        if chunk:
+            write(process_chunk(conversation_id, chunk))
+    return conversation_id, len(done), counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bloqueo masivo de líneas (sin LLM) a partir de un CSV o JSONL.")
+    parser.add_argument("input", help="Archivo CSV (con encabezado) o JSONL con phone_number, document_digits y reason.")
+    parser.add_argument("--output", help="Resultados por fila en JSONL; si ya existe, la ejecución se reanuda. Por defecto <input>.resultados.jsonl.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Filas por consulta de usuarios e insert de tickets.")
+    args = parser.parse_args()
+
+    output_path = args.output or f"{os.path.splitext(args.input)[0]}.resultados.jsonl"
+    try:
+        conversation_id, skipped, counts = run(args.input, output_path, args.chunk_size)
+    except Exception as e:
+        # Lo ya escrito en el archivo de resultados queda confirmado; volver a ejecutar reanuda.
+        print(f"Error en el bloqueo masivo, se puede reanudar con el mismo --output: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps({"conversation_id": conversation_id, "filas_omitidas_por_reanudacion": skipped, "resultados": counts}, ensure_ascii=False))
+    print(f"Resultados guardados en {output_path}")
+
+
+if __name__ == "__main__":
+    main()
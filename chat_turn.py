@@ -0,0 +1,126 @@
+from chat_utils import (
+    get_llm_response_stream, save_message, finish_turn, process_llm_command
+)
+from stream_parser import StreamingResponseParser
+from state_engine import run_fast_path
+from telemetry import span, redact
+import logging
+
+DEFAULT_CONVERSATION_TITLE = "Nueva Solicitud de Bloqueo"
+
+logger = logging.getLogger(__name__)
+
+
+class TurnResult:
+    def __init__(self, final_response, bot_message, system_feedback, fast_path, new_title):
+        self.final_response = final_response
+        self.bot_message = bot_message
+        self.system_feedback = system_feedback
+        self.fast_path = fast_path
+        self.new_title = new_title
+
+    @property
+    def ticket_created(self):
+        return bool(self.system_feedback) and self.system_feedback.startswith("OK_TICKET")
+
+
+def stream_llm_reply(history, api_key, provider, facts=None, on_text=None, on_wait=None):
+    # Muestra los fragmentos a medida que llegan y corta el stream en cuanto se cierra un comando interno
+    parser = StreamingResponseParser()
+    if on_wait:
+        on_wait()
+    stream = get_llm_response_stream(history, api_key, provider, facts)
+    try:
+        for chunk in stream:
+            if parser.feed(chunk) and on_text:
+                on_text(parser.display_text)
+            if parser.command_complete:
+                break
+    finally:
+        stream.close()
+    parser.close()
+    return parser.command_response if parser.is_command else parser.raw_text
+
+
+def _redact(text, flow):
+    # El nombre validado aparece en las respuestas ("¡Perfecto, <nombre>!"); se enmascara también
+    return redact(text, name=flow.facts().get("name"))
+
+
+# Turno completo sin dependencias de la UI: main.py lo ejecuta con callbacks de Streamlit y
+# benchmarks/turn_benchmark.py lo ejecuta en modo headless.
+def run_chat_turn(conversation_id, messages, prompt, api_key, provider, flow,
+                  fast_path_enabled=True, conversation_title=None, on_text=None, on_wait=None):
+    # Un span por turno; las llamadas al LLM, a Supabase y los comandos quedan como spans hijos
+    with span("turn", conversation_id=conversation_id, provider=provider) as turn_span:
+        result = _run_chat_turn(conversation_id, messages, prompt, api_key, provider, flow,
+                                fast_path_enabled, conversation_title, on_text, on_wait)
+        turn_span.set(fast_path=result.fast_path, command=bool(result.system_feedback), ticket_created=result.ticket_created)
+        return result
+
+
+def _run_chat_turn(conversation_id, messages, prompt, api_key, provider, flow,
+                   fast_path_enabled, conversation_title, on_text, on_wait):
+    # 1. Guardar mensaje del usuario
+    messages.append(save_message(conversation_id, "user", prompt, is_command=False))
+
+    # Los logs pasan por redact(): nunca se registran documentos, teléfonos completos ni el nombre validado
+    logger.info(f"[USER]: {_redact(prompt, flow)}")
+
+    # 2. Bucle de procesamiento para manejar el flujo comando -> respuesta
+    # Ruta rápida: la máquina de estados local resuelve el turno sin llamar al LLM
+    fast_result = None
+    system_feedback = None
+    if fast_path_enabled:
+        fast_result = run_fast_path(flow, prompt, conversation_id, process_llm_command)
+
+    if fast_result:
+        system_feedback = fast_result.system_feedback
+        if fast_result.command:
+            messages.append(save_message(conversation_id, "assistant", fast_result.command, is_command=True))
+            logger.info(f"[Fast Path Command]: {_redact(fast_result.command, flow)}")
+            logger.info(f"[System Feedback]: {_redact(fast_result.system_feedback, flow)}")
+        final_response_content = fast_result.reply
+        logger.info(f"[Fast Path Response]: {_redact(final_response_content, flow)}")
+
+    else:
+        # Llamada inicial al LLM (en streaming)
+        llm_response = stream_llm_reply(messages, api_key, provider, flow.facts(), on_text, on_wait)
+        logger.info(f"[LLM Raw Response]: {_redact(llm_response, flow)}")
+
+        # Procesar si la respuesta es un comando
+        system_feedback = process_llm_command(llm_response, conversation_id)
+
+        if system_feedback:
+            # Es un comando. Lo guardamos en el historial y en la BD
+            messages.append(save_message(conversation_id, "assistant", llm_response, is_command=True))
+            logger.info(f"[System Feedback]: {_redact(system_feedback, flow)}")
+            # Sincronizamos la máquina de estados local con el comando emitido por el LLM
+            flow.observe(llm_response, system_feedback)
+
+            # Creamos un mensaje de feedback para la siguiente llamada al LLM
+            feedback_message = {"role": "user", "content": system_feedback}
+
+            # Hacemos la SEGUNDA llamada al LLM para obtener la respuesta conversacional
+            final_response_content = stream_llm_reply(messages + [feedback_message], api_key, provider, flow.facts(), on_text, on_wait)
+            logger.info(f"[LLM Final Conversational Response]: {_redact(final_response_content, flow)}")
+
+        else:
+            # No es un comando, es una respuesta conversacional directa
+            final_response_content = llm_response
+    # 3. Guardar la respuesta final del bot
+    bot_message = None
+    if final_response_content:
+        bot_message = save_message(conversation_id, "assistant", final_response_content, is_command=False)
+        messages.append(bot_message)
+
+    # 4. Renombrar conversación
+    new_title = None
+    is_first_user_message = len([m for m in messages if m['role'] == 'user']) == 1
+    if is_first_user_message and conversation_title == DEFAULT_CONVERSATION_TITLE:
+        new_title = prompt[:40] + "..." if len(prompt) > 40 else prompt
+
+    # 5. Persistir el turno: un solo insert masivo de mensajes (y el renombrado en paralelo)
+    finish_turn(conversation_id, new_title)
+
+    return TurnResult(final_response_content, bot_message, system_feedback, fast_result is not None, new_title)
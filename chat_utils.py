@@ -1,12 +1,19 @@
-from supabase_config import supabase
-from openai import OpenAI
-import google.generativeai as genai
+from supabase_config import get_supabase
+from llm_clients import get_llm_client
+from data_access import get_data_access
+from ttl_cache import TTLCache, MISSING, data_versions
+from context_builder import build_context
+from prompt_cache import gemini_prompt_cache, is_cache_error, record_gemini_usage, record_openai_usage
+from telemetry import span, db_span, redact
+from ticket_ids import ticket_ids
+from llm_dispatch import llm_dispatcher
+from response_cache import response_cache
+from command_parser import parse_response, command_registry
+import logging
 import os
-import re
 import json
+import time
 import uuid
-import datetime
-import random
 
 # SYSTEM PROMPT 
 SYSTEM_PROMPT = """
@@ -81,166 +88,401 @@ Tu operación sigue una máquina de estados finitos. Solo puedes realizar la acc
     - **Si es ERROR:** `<respuesta_conversacional>Lo siento, ha ocurrido un error inesperado al intentar generar el bloqueo. Por favor, intenta de nuevo en unos minutos o contacta a soporte directamente.</respuesta_conversacional>`
 """
 
-MAX_CONTEXT_MESSAGES = 30
+GEMINI_MODEL = "gemini-2.5-flash-lite"
+OPENAI_MODEL = "gpt-4.1-nano"
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL", "300"))
+# Unknown numbers are cached for a shorter time so a newly registered line shows up quickly.
+USER_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("USER_CACHE_NEGATIVE_TTL", "60"))
+
+user_cache = TTLCache(USER_CACHE_MAX_SIZE, USER_CACHE_TTL_SECONDS)
+TICKET_BULK_CHUNK_SIZE = int(os.getenv("TICKET_BULK_CHUNK_SIZE", "200"))
+# A ticket_number collision is retried with a fresh id this many times.
+TICKET_INSERT_MAX_ATTEMPTS = 3
+MODELS = {"gemini": GEMINI_MODEL, "openai": OPENAI_MODEL}
+
+logger = logging.getLogger(__name__)
 
 
 # --- Conversation Management ---
 def create_conversation(session_id, title="Nueva Solicitud de Bloqueo"):
     try:
-        response = supabase.table("conversations").insert({
-            "session_id": session_id,
-            "title": title
-        }).execute()
+        with db_span("conversations", "insert") as op:
+            response = get_supabase().table("conversations").insert({
+                "session_id": session_id,
+                "title": title
+            }).execute()
+            op.set(rows=len(response.data or []))
+        data_versions.bump("session", session_id)
         return response.data[0] if response.data else None
     except Exception as e:
-        print(f"Error creando conversación: {e}")
+        logger.error(f"Error creando conversación: {e}")
         return None
 
 def get_user_conversations(session_id):
-    try:
-        response = supabase.table("conversations").select("id, title, created_at, updated_at").eq("session_id", session_id).order("updated_at", desc=True).execute()
-        return response.data if response.data else []
-    except Exception as e:
-        print(f"Error obteniendo conversaciones: {e}")
-        return []
+    return get_data_access().get_conversations(session_id)
 
 def delete_conversation_and_messages(conversation_id):
     try:
-        supabase.table("messages").delete().eq("conversation_id", conversation_id).execute()
-        supabase.table("conversations").delete().eq("id", conversation_id).execute()
+        # Queued messages of this conversation must land before the delete, not after it.
+        get_data_access().flush()
+        with db_span("messages", "delete"):
+            get_supabase().table("messages").delete().eq("conversation_id", conversation_id).execute()
+        with db_span("conversations", "delete"):
+            get_supabase().table("conversations").delete().eq("id", conversation_id).execute()
+        data_versions.forget("conversation", conversation_id)
+        data_versions.forget("tickets", conversation_id)
+        return True
     except Exception as e:
-        print(f"Error borrando conversación {conversation_id}: {e}")
+        logger.error(f"Error borrando conversación {conversation_id}: {e}")
+        return False
 
 def rename_conversation(conversation_id, new_title):
-    try:
-        supabase.table("conversations").update({"title": new_title, "updated_at": "now()"}).eq("id", conversation_id).execute()
-    except Exception as e:
-        print(f"Error renombrando conversación {conversation_id}: {e}")
+    get_data_access().rename_conversation(conversation_id, new_title)
+    data_versions.bump("conversation", conversation_id)
 
 # --- Message Management ---
-def save_message(conversation_id, role, content):
-    try:
-        supabase.table("messages").insert({
-            "conversation_id": conversation_id,
-            "role": role,
-            "content": content
-        }).execute()
-    except Exception as e:
-        print(f"Error guardando mensaje: {e}")
+# Writes are queued and flushed as one bulk insert per turn (see data_access.py).
+def save_message(conversation_id, role, content, is_command=None):
+    # Returns the message in display form (with created_at and precomputed display text).
+    return get_data_access().queue_message(conversation_id, role, content, is_command)
+
+def finish_turn(conversation_id, new_title=None):
+    get_data_access().finish_turn(conversation_id, new_title)
+    if new_title:
+        data_versions.bump("conversation", conversation_id)
 
 def get_messages_for_conversation(conversation_id):
-    try:
-        response = supabase.table("messages").select("role, content").eq("conversation_id", conversation_id).order("created_at", desc=False).execute()
-        messages = []
-        if response.data:
-            for msg in response.data:
-                content = msg["content"]
-                is_command = content.startswith("<comando_interno>")
-                messages.append({
-                    "role": msg["role"],
-                    "content": content,
-                    "is_command": is_command
-                })
-        return messages
-    except Exception as e:
-        print(f"Error obteniendo mensajes: {e}")
-        return []
+    return get_data_access().get_messages(conversation_id)
+
+def get_messages_page(conversation_id, before=None):
+    # Latest page when before is None; otherwise the page right before that created_at cursor.
+    return get_data_access().get_messages_page(conversation_id, before=before)
+
+def get_messages_since(conversation_id, after):
+    return get_data_access().get_messages_since(conversation_id, after)
+
+def load_conversation(conversation_id):
+    return get_data_access().load_conversation(conversation_id)
+
+# --- TelcoID Lookup ---
+def get_user_by_phone(phone):
+    # Returns the user record, or None if the number isn't registered. DB errors propagate and aren't cached.
+    cached = user_cache.get(phone)
+    if cached is not MISSING:
+        return cached
+    with db_span("users", "select") as op:
+        response = get_supabase().table("users").select("document_number, full_name").eq("phone_number", phone).limit(1).execute()
+        op.set(rows=len(response.data or []))
+    user = response.data[0] if response.data else None
+    user_cache.set(phone, user, ttl=None if user else USER_CACHE_NEGATIVE_TTL_SECONDS)
+    return user
+
+def get_users_by_phones(phones):
+    # Batched version of get_user_by_phone: cache misses are resolved with one in_() query.
+    users, missing = {}, []
+    for phone in dict.fromkeys(phones):
+        cached = user_cache.get(phone)
+        if cached is MISSING:
+            missing.append(phone)
+        else:
+            users[phone] = cached
+    if missing:
+        with db_span("users", "select", batch=len(missing)) as op:
+            response = get_supabase().table("users").select("phone_number, document_number, full_name").in_("phone_number", missing).execute()
+            op.set(rows=len(response.data or []))
+        found = {row["phone_number"]: {"document_number": row["document_number"], "full_name": row["full_name"]} for row in response.data or []}
+        for phone in missing:
+            user = found.get(phone)
+            user_cache.set(phone, user, ttl=None if user else USER_CACHE_NEGATIVE_TTL_SECONDS)
+            users[phone] = user
+    return users
+
+def document_matches(user, digits):
+    return bool(user) and user["document_number"].endswith(digits)
+
+def invalidate_user(phone):
+    user_cache.invalidate(phone)
+
+def clear_user_cache():
+    user_cache.clear()
+
+def get_user_cache_stats():
+    return user_cache.stats()
 
 # --- Ticket Management ---
 def generate_ticket_number():
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M")
-    return f"TEL-{timestamp}-{random.randint(100, 999)}"
+    return ticket_ids.next_id()
+
+def _is_unique_violation(error):
+    return str(getattr(error, "code", "") or "") == "23505"
+
+def _is_ticket_number_violation(error):
+    # PostgREST names the constraint/key in message and details, e.g. "Key (ticket_number)=(...)".
+    return _is_unique_violation(error) and "ticket_number" in f"{getattr(error, 'message', '')} {getattr(error, 'details', '')} {error}"
+
+def _find_ticket(conversation_id, phone_number):
+    with db_span("tickets", "select") as op:
+        response = get_supabase().table("tickets").select("*").eq("conversation_id", conversation_id).eq("phone_number", phone_number).limit(1).execute()
+        op.set(rows=len(response.data or []))
+    return response.data[0] if response.data else None
+
+def _insert_ticket(conversation_id, phone_number, document_number, user_name, block_reason):
+    for attempt in range(TICKET_INSERT_MAX_ATTEMPTS):
+        try:
+            with db_span("tickets", "insert", attempt=attempt + 1) as op:
+                response = get_supabase().table("tickets").insert({
+                    "ticket_number": generate_ticket_number(),
+                    "conversation_id": conversation_id,
+                    "phone_number": phone_number,
+                    "document_number": document_number,
+                    "user_name": user_name,
+                    "block_reason": block_reason,
+                    "status": "active"
+                }).execute()
+                op.set(rows=len(response.data or []))
+            return response
+        except Exception as e:
+            if not _is_ticket_number_violation(e) or attempt + 1 == TICKET_INSERT_MAX_ATTEMPTS:
+                raise
+            logger.warning("Número de ticket repetido, se reintenta con uno nuevo.")
 
 def create_ticket(conversation_id, phone_number, document_number, user_name, block_reason="perdida"):
+    # Idempotent per (conversation_id, phone_number): a re-emitted GENERAR_TICKET or a repeated
+    # turn returns the ticket that already exists instead of inserting a second block.
     try:
-        ticket_number = generate_ticket_number()
-        response = supabase.table("tickets").insert({
-            "ticket_number": ticket_number,
-            "conversation_id": conversation_id,
-            "phone_number": phone_number,
-            "document_number": document_number,
-            "user_name": user_name,
-            "block_reason": block_reason,
-            "status": "active"
-        }).execute()
+        if conversation_id:
+            existing = _find_ticket(conversation_id, phone_number)
+            if existing:
+                return existing, None
+        response = _insert_ticket(conversation_id, phone_number, document_number, user_name, block_reason)
         if response.data:
+            data_versions.bump("tickets", conversation_id)
             return response.data[0], None
         return None, "Error al guardar el ticket en la base de datos."
     except Exception as e:
-        print(f"Error creando ticket: {e}")
+        # A concurrent request won the race on the (conversation_id, phone_number) constraint.
+        if conversation_id and _is_unique_violation(e) and not _is_ticket_number_violation(e):
+            try:
+                existing = _find_ticket(conversation_id, phone_number)
+                if existing:
+                    return existing, None
+            except Exception as lookup_error:
+                e = lookup_error
+        logger.error(f"Error creando ticket: {redact(str(e))}")
         return None, str(e)
 
+def create_tickets_bulk(conversation_id, requests, chunk_size=TICKET_BULK_CHUNK_SIZE):
+    # requests: dicts with phone_number, document_number, user_name, block_reason. Returns
+    # {phone_number: ticket}; phones that already have a ticket in the conversation get the
+    # existing one, so re-running a batch never inserts twice.
+    tickets = {}
+    for start in range(0, len(requests), chunk_size):
+        chunk = requests[start:start + chunk_size]
+        phones = list(dict.fromkeys(r["phone_number"] for r in chunk))
+        with db_span("tickets", "select", batch=len(phones)) as op:
+            response = get_supabase().table("tickets").select("*").eq("conversation_id", conversation_id).in_("phone_number", phones).execute()
+            op.set(rows=len(response.data or []))
+        tickets.update({row["phone_number"]: row for row in response.data or []})
+        new = [r for r in {r["phone_number"]: r for r in chunk}.values() if r["phone_number"] not in tickets]
+        if not new:
+            continue
+        rows = [{
+            "ticket_number": ticket_number,
+            "conversation_id": conversation_id,
+            "phone_number": r["phone_number"],
+            "document_number": r["document_number"],
+            "user_name": r["user_name"],
+            "block_reason": r["block_reason"],
+            "status": "active"
+        } for r, ticket_number in zip(new, ticket_ids.next_batch(len(new)))]
+        with db_span("tickets", "insert", rows=len(rows)):
+            response = get_supabase().table("tickets").insert(rows).execute()
+        data_versions.bump("tickets", conversation_id)
+        tickets.update({row["phone_number"]: row for row in response.data or []})
+    return tickets
+
 def get_tickets_by_conversation(conversation_id):
-    try:
-        response = supabase.table("tickets").select("*").eq("conversation_id", conversation_id).order("created_at", desc=True).execute()
-        return response.data or []
-    except Exception as e:
-        print(f"Error obteniendo tickets: {e}")
-        return []
+    return get_data_access().get_tickets(conversation_id)
 
 # --- LLM Interaction ---
-def _get_llm_response_base(model_provider, messages, api_key):
+def _gemini_generate(api_key, messages, stream=False):
+    history = [{"role": "model" if m["role"] == "assistant" else "user", "parts": [m["content"]]} for m in messages]
+    # The static SYSTEM_PROMPT is served from a provider-side context cache when available.
+    cached_content = gemini_prompt_cache.get(api_key, GEMINI_MODEL, SYSTEM_PROMPT)
+    model = get_llm_client("gemini", api_key, GEMINI_MODEL, system_instruction=SYSTEM_PROMPT, cached_content=cached_content)
     try:
+        return model.generate_content(history, stream=stream)
+    except Exception as e:
+        if cached_content is None or not is_cache_error(e):
+            raise
+        # The cache expired or was deleted provider-side; retry once with the full prompt.
+        logger.warning(f"Caché de contexto de Gemini no válida, se reintenta sin caché: {e}")
+        gemini_prompt_cache.invalidate(api_key, GEMINI_MODEL, SYSTEM_PROMPT, cached_content)
+        model = get_llm_client("gemini", api_key, GEMINI_MODEL, system_instruction=SYSTEM_PROMPT)
+        return model.generate_content(history, stream=stream)
+
+def _openai_messages(messages):
+    # SYSTEM_PROMPT always goes first and byte-identical so OpenAI's automatic prefix cache hits;
+    # everything that changes per call (pinned facts, history) comes after it.
+    return [{"role": "system", "content": SYSTEM_PROMPT}] + messages
+
+# One provider attempt; errors propagate so llm_dispatch can retry, hedge or fail over.
+def _complete_llm(model_provider, messages, api_key):
+    with span("llm.call", provider=model_provider, model=MODELS.get(model_provider), stream=False, messages=len(messages)) as llm_span:
         if model_provider == "gemini":
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel("gemini-2.5-flash-lite", system_instruction=SYSTEM_PROMPT)
-            history = [{"role": "model" if m["role"] == "assistant" else "user", "parts": [m["content"]]} for m in messages]
-            response = model.generate_content(history)
+            response = _gemini_generate(api_key, messages)
+            llm_span.set(ttfb_ms=round(llm_span.elapsed_ms(), 3), **record_gemini_usage(GEMINI_MODEL, response.usage_metadata))
             return response.text
-        elif model_provider == "openai":
-            client = OpenAI(api_key=api_key)
-            response = client.chat.completions.create(model="gpt-4.1-nano", messages=[{"role": "system", "content": SYSTEM_PROMPT}] + messages, temperature=0.1, max_tokens=1024)
-            return response.choices[0].message.content
+        client = get_llm_client("openai", api_key, OPENAI_MODEL)
+        response = client.chat.completions.create(model=OPENAI_MODEL, messages=_openai_messages(messages), temperature=0.1, max_tokens=1024)
+        llm_span.set(ttfb_ms=round(llm_span.elapsed_ms(), 3), **record_openai_usage(OPENAI_MODEL, response.usage))
+        return response.choices[0].message.content
+
+def _stream_llm(model_provider, messages, api_key):
+    # Not made the current span: the generator is consumed (and closed) from the caller's frame.
+    llm_span = span("llm.call", provider=model_provider, model=MODELS.get(model_provider), stream=True, messages=len(messages)).start()
+    first_chunk = True
+    error = None
+    try:
+        if model_provider == "gemini":
+            usage = None
+            try:
+                for chunk in _gemini_generate(api_key, messages, stream=True):
+                    usage = chunk.usage_metadata or usage
+                    # Chunks without text parts (e.g. the final usage chunk) raise on .text
+                    text = chunk.text if chunk.parts else ""
+                    if text:
+                        if first_chunk:
+                            first_chunk = False
+                            llm_span.set(ttfb_ms=round(llm_span.elapsed_ms(), 3))
+                        yield text
+            finally:
+                llm_span.set(**record_gemini_usage(GEMINI_MODEL, usage))
+        else:
+            client = get_llm_client("openai", api_key, OPENAI_MODEL)
+            stream = client.chat.completions.create(model=OPENAI_MODEL, messages=_openai_messages(messages), temperature=0.1, max_tokens=1024, stream=True, stream_options={"include_usage": True})
+            try:
+                for chunk in stream:
+                    if chunk.usage:
+                        llm_span.set(**record_openai_usage(OPENAI_MODEL, chunk.usage))
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_chunk:
+                            first_chunk = False
+                            llm_span.set(ttfb_ms=round(llm_span.elapsed_ms(), 3))
+                        yield chunk.choices[0].delta.content
+            finally:
+                # Releases the pooled connection when the caller stops early (command detected).
+                stream.close()
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        llm_span.finish(error)
+
+def _llm_error_reply(model_provider, error):
+    logger.error(f"Error en la llamada al LLM ({model_provider}): {error}")
+    return f"<respuesta_conversacional>Error de comunicación con el modelo de IA. Verifica la API Key. Detalles: {error}</respuesta_conversacional>"
+
+def _get_llm_response_base(model_provider, messages, api_key):
+    if model_provider not in MODELS:
         return f"Proveedor LLM '{model_provider}' no soportado."
+    try:
+        return llm_dispatcher.complete(model_provider, api_key, lambda provider, key: _complete_llm(provider, messages, key))
     except Exception as e:
-        print(f"Error en la llamada al LLM ({model_provider}): {e}")
-        return f"<respuesta_conversacional>Error de comunicación con el modelo de IA. Verifica la API Key. Detalles: {e}</respuesta_conversacional>"
+        return _llm_error_reply(model_provider, e)
 
-def get_llm_response(chat_history, api_key, provider="gemini"):
-    history_for_llm = [msg for msg in chat_history]
-    return _get_llm_response_base(provider, history_for_llm[-MAX_CONTEXT_MESSAGES:], api_key)
+def _stream_llm_response_base(model_provider, messages, api_key):
+    if model_provider not in MODELS:
+        yield f"Proveedor LLM '{model_provider}' no soportado."
+        return
+    try:
+        # Rate limiting, retries before the first chunk and the optional hedge happen in llm_dispatch.
+        yield from llm_dispatcher.stream(model_provider, api_key, lambda provider, key: _stream_llm(provider, messages, key))
+    except Exception as e:
+        yield _llm_error_reply(model_provider, e)
+
+# facts: validated phone/document/name known outside the history (e.g. FlowState.facts()); they're
+# pinned as a compact summary so trimming the history to the token budget never loses them.
+def get_llm_response(chat_history, api_key, provider="gemini", facts=None):
+    messages = build_context(chat_history, facts)
+    key = response_cache.key_for(provider, MODELS.get(provider), messages)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+    start = time.perf_counter()
+    response = _get_llm_response_base(provider, messages, api_key)
+    response_cache.set(key, response, time.perf_counter() - start, messages, facts)
+    return response
+
+def get_llm_response_stream(chat_history, api_key, provider="gemini", facts=None):
+    messages = build_context(chat_history, facts)
+    key = response_cache.key_for(provider, MODELS.get(provider), messages)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return _replay_cached(cached)
+    return _stream_and_cache(key, _stream_llm_response_base(provider, messages, api_key), messages, facts)
+
+def _replay_cached(text):
+    yield text
+
+def _stream_and_cache(key, stream, messages, facts):
+    # Stored only when the stream ran to the end; commands are cut early and never cached anyway.
+    start = time.perf_counter()
+    chunks = []
+    try:
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+    finally:
+        stream.close()
+    response_cache.set(key, "".join(chunks), time.perf_counter() - start, messages, facts)
 
 # --- Command Processing ---
+# Each <comando_interno> registers its argument pattern and handler; new commands only add an entry here.
+@command_registry.register("VALIDAR_TELCOID", args_pattern=r"\s*(?P<phone>\d{10,})")
+def _validate_telcoid(args, conversation_id):
+    try:
+        user = get_user_by_phone(args["phone"])
+    except Exception:
+        user = None
+    if not user:
+        return "ERROR_TELCOID:El número no está registrado."
+    return f"OK_TELCOID:DOC:{user['document_number']}:NOMBRE:{user['full_name']}"
+
+@command_registry.register("VALIDAR_DOCUMENTO", args_pattern=r"\s*(?P<phone>\d{10,})\s*:\s*(?P<digits>\d{3,})")
+def _validate_document(args, conversation_id):
+    try:
+        # Served from the record cached by VALIDAR_TELCOID, no second query
+        user = get_user_by_phone(args["phone"])
+    except Exception:
+        user = None
+    if not user:
+        return "ERROR_VALIDACION:No se pudo validar el documento."
+    if document_matches(user, args["digits"]):
+        return "OK_VALIDACION"
+    return "ERROR_VALIDACION:Los dígitos no coinciden."
+
+@command_registry.register(
+    "GENERAR_TICKET",
+    args_pattern=r"(?P<phone>[^:]*):(?P<document>[^:]*):(?P<user_name>[^:]*):(?P<reason>.*)",
+    malformed_feedback="ERROR_TICKET:Formato de comando incorrecto.",
+)
+def _generate_ticket(args, conversation_id):
+    if not conversation_id: return "ERROR_TICKET:ID de conversación no proporcionado."
+    try:
+        ticket_data, error_msg = create_ticket(conversation_id, args["phone"], args["document"], args["user_name"], args["reason"])
+        return f"OK_TICKET:TICKET:{ticket_data['ticket_number']}" if ticket_data else f"ERROR_TICKET:{error_msg or 'Error desconocido'}"
+    except Exception as e:
+        return f"ERROR_TICKET:Error inesperado al procesar el ticket: {e}"
+
 def process_llm_command(response_text, conversation_id=None):
-    command_match = re.search(r'<comando_interno>(.*?)</comando_interno>', response_text, re.DOTALL)
-    
-    if not command_match:
+    # One pass classifies the response and extracts typed arguments; None when it isn't a command.
+    parsed = parse_response(response_text)
+    if not parsed.is_command:
         return None
 
-    command = command_match.group(1).strip()
-    
-    telcoid_match = re.match(r'VALIDAR_TELCOID\s*:\s*(\d{10,})', command, re.IGNORECASE)
-    if telcoid_match:
-        phone = telcoid_match.group(1)
-        try:
-            user_response = supabase.table("users").select("document_number, full_name").eq("phone_number", phone).single().execute()
-            user = user_response.data
-            return f"OK_TELCOID:DOC:{user['document_number']}:NOMBRE:{user['full_name']}"
-        except Exception:
-            return "ERROR_TELCOID:El número no está registrado."
-
-    doc_match = re.match(r'VALIDAR_DOCUMENTO\s*:\s*(\d{10,})\s*:\s*(\d{3,})', command, re.IGNORECASE)
-    if doc_match:
-        phone, digits = doc_match.group(1), doc_match.group(2)
-        try:
-            doc_response = supabase.table("users").select("document_number").eq("phone_number", phone).single().execute()
-            if doc_response.data and doc_response.data['document_number'].endswith(digits):
-                return "OK_VALIDACION"
-            else:
-                return "ERROR_VALIDACION:Los dígitos no coinciden."
-        except Exception:
-            return "ERROR_VALIDACION:No se pudo validar el documento."
-
-    ticket_match = re.match(r'GENERAR_TICKET\s*:', command, re.IGNORECASE)
-    if ticket_match:
-        if not conversation_id: return "ERROR_TICKET:ID de conversación no proporcionado."
-        try:
-            parts = command.split(":", 4)
-            if len(parts) < 5: return "ERROR_TICKET:Formato de comando incorrecto."
-            _, phone, document, user_name, reason = parts
-            ticket_data, error_msg = create_ticket(conversation_id, phone.strip(), document.strip(), user_name.strip(), reason.strip())
-            return f"OK_TICKET:TICKET:{ticket_data['ticket_number']}" if ticket_data else f"ERROR_TICKET:{error_msg or 'Error desconocido'}"
-        except Exception as e:
-            return f"ERROR_TICKET:Error inesperado al procesar el ticket: {e}"
-            
-    return f"ERROR_UNKNOWN_COMMAND:Comando no reconocido: {command}"
\ No newline at end of file
+    with span("command", command=parsed.name) as command_span:
+        feedback = command_registry.dispatch(parsed, conversation_id)
+        command_span.set(outcome=feedback.split(":", 1)[0])
+    return feedback
\ No newline at end of file
@@ -0,0 +1,121 @@
+import re
+
+OPEN_CONVERSATIONAL = "<respuesta_conversacional>"
+CLOSE_CONVERSATIONAL = "</respuesta_conversacional>"
+OPEN_COMMAND = "<comando_interno>"
+CLOSE_COMMAND = "</comando_interno>"
+
+KIND_CONVERSATIONAL = "conversational"
+KIND_COMMAND = "command"
+# An opening tag that never closes (truncated or broken output).
+KIND_MALFORMED = "malformed"
+# No tags at all; shown as-is.
+KIND_PLAIN = "plain"
+
+COMMAND_BODY_PATTERN = re.compile(r"\s*([A-Za-z_]+)\s*(?::(.*))?", re.DOTALL)
+
+# Backend feedback sent back to the model as a user message.
+FEEDBACK_PATTERN = re.compile(r"(OK|ERROR)_[A-Z_]+")
+TELCOID_OK_PATTERN = re.compile(r"OK_TELCOID:DOC:(.*?):NOMBRE:(.*)", re.DOTALL)
+TICKET_OK_PATTERN = re.compile(r"OK_TICKET:TICKET:(\S+)")
+
+
+class ParsedResponse:
+    __slots__ = ("kind", "text", "command", "name", "raw_args", "args")
+
+    def __init__(self, kind, text, command=None, name=None, raw_args=None, args=None):
+        self.kind = kind
+        self.text = text  # Display text for conversational/plain responses
+        self.command = command  # Full command body, e.g. "VALIDAR_TELCOID:3001234567"
+        self.name = name  # Upper-cased command name
+        self.raw_args = raw_args
+        self.args = args  # Typed arguments; None when the command is unknown or its arguments don't parse
+
+    @property
+    def is_command(self):
+        return self.kind == KIND_COMMAND
+
+
+class CommandSpec:
+    def __init__(self, name, handler, args_pattern=None, malformed_feedback=None):
+        self.name = name
+        self.handler = handler
+        self.args_pattern = re.compile(args_pattern, re.DOTALL) if isinstance(args_pattern, str) else args_pattern
+        self.malformed_feedback = malformed_feedback
+
+    def parse_args(self, raw_args):
+        if self.args_pattern is None:
+            return {}
+        match = self.args_pattern.match(raw_args or "")
+        if not match:
+            return None
+        return {key: value.strip() for key, value in match.groupdict().items()}
+
+
+class CommandRegistry:
+    # Dispatch table for <comando_interno> commands: each command registers its argument pattern
+    # (named groups become the handler's arguments) and a handler(args, conversation_id) -> feedback.
+    def __init__(self):
+        self._specs = {}
+
+    def register(self, name, args_pattern=None, malformed_feedback=None):
+        def decorator(handler):
+            self._specs[name.upper()] = CommandSpec(name.upper(), handler, args_pattern, malformed_feedback)
+            return handler
+        return decorator
+
+    def get(self, name):
+        return self._specs.get(name)
+
+    def names(self):
+        return list(self._specs)
+
+    def dispatch(self, parsed, conversation_id=None):
+        # Backend feedback for a parsed command response; None when it isn't a command.
+        if not parsed.is_command:
+            return None
+        spec = self._specs.get(parsed.name)
+        if spec is None or parsed.args is None:
+            if spec is not None and spec.malformed_feedback:
+                return spec.malformed_feedback
+            return f"ERROR_UNKNOWN_COMMAND:Comando no reconocido: {parsed.command}"
+        return spec.handler(parsed.args, conversation_id)
+
+
+command_registry = CommandRegistry()
+
+
+def _tag_body(text, open_tag, close_tag):
+    # (body, found_open): plain str.find scans, cheaper than a lazy regex over the whole text.
+    start = text.find(open_tag)
+    if start == -1:
+        return None, False
+    start += len(open_tag)
+    end = text.find(close_tag, start)
+    return (text[start:end] if end != -1 else None), True
+
+
+def parse_response(text, registry=command_registry):
+    # A command anywhere wins (it drives the backend), then the first conversational block, then
+    # an unclosed tag, else untagged text.
+    text = text or ""
+    command, command_open = _tag_body(text, OPEN_COMMAND, CLOSE_COMMAND)
+    if command is not None:
+        command = command.strip()
+        body = COMMAND_BODY_PATTERN.match(command)
+        name = body.group(1).upper() if body else ""
+        raw_args = body.group(2) if body else None
+        spec = registry.get(name)
+        args = spec.parse_args(raw_args) if spec else None
+        return ParsedResponse(KIND_COMMAND, None, command, name, raw_args, args)
+    reply, reply_open = _tag_body(text, OPEN_CONVERSATIONAL, CLOSE_CONVERSATIONAL)
+    if reply is not None:
+        return ParsedResponse(KIND_CONVERSATIONAL, reply.strip())
+    if command_open or reply_open:
+        return ParsedResponse(KIND_MALFORMED, text)
+    return ParsedResponse(KIND_PLAIN, text)
+
+
+def extract_conversational_response(text):
+    parsed = parse_response(text)
+    return parsed.text if parsed.text is not None else text
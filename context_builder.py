@@ -0,0 +1,121 @@
+from command_parser import parse_response, FEEDBACK_PATTERN, TELCOID_OK_PATTERN
+import os
+
+# --- Budget Configuration ---
+CONTEXT_TOKEN_BUDGET = int(os.getenv("LLM_CONTEXT_TOKEN_BUDGET", "1500"))
+# Rough heuristic for Spanish text with these tokenizers; only used to pack the budget.
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Drop priorities: lower numbers go first when the history doesn't fit.
+PRIORITY_RESOLVED = 0
+PRIORITY_COMMAND = 1
+PRIORITY_NORMAL = 2
+
+
+def estimate_tokens(text):
+    return MESSAGE_OVERHEAD_TOKENS + (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _command(message):
+    parsed = parse_response(message["content"]) if message["role"] == "assistant" else None
+    if parsed is None or not parsed.is_command:
+        return None, None
+    return parsed.name, (parsed.raw_args or "").strip()
+
+
+def extract_facts(messages, facts=None):
+    # Facts the state machine needs in ESTADO 6; known facts (from the local FlowState) win over the history.
+    found = {"phone": None, "document": None, "name": None}
+    candidate_phone = None
+    for message in messages:
+        name, args = _command(message)
+        if name == "VALIDAR_TELCOID":
+            candidate_phone = args
+            continue
+        ok_match = TELCOID_OK_PATTERN.match(message["content"]) if message["role"] == "user" else None
+        if ok_match:
+            found = {"phone": candidate_phone, "document": ok_match.group(1).strip(), "name": ok_match.group(2).strip()}
+    for key, value in (facts or {}).items():
+        if value:
+            found[key] = value
+    return found
+
+
+def build_facts_summary(facts):
+    if not (facts.get("document") and facts.get("name")):
+        return None
+    return (
+        "[DATOS VALIDADOS POR EL SISTEMA] "
+        f"TELEFONO:{facts.get('phone') or 'desconocido'} | "
+        f"OK_TELCOID:DOC:{facts['document']}:NOMBRE:{facts['name']}"
+    )
+
+
+def _split_exchanges(messages):
+    # An exchange starts at each user message and holds the commands, backend feedback and replies that follow it.
+    exchanges = []
+    for index, message in enumerate(messages):
+        is_feedback = message["role"] == "user" and FEEDBACK_PATTERN.match(message["content"])
+        if (message["role"] == "user" and not is_feedback) or not exchanges:
+            exchanges.append([])
+        exchanges[-1].append(index)
+    return exchanges
+
+
+def _exchange_priorities(messages, exchanges):
+    exchange_commands = []
+    for exchange in exchanges:
+        names = {_command(messages[i])[0] for i in exchange} - {None}
+        exchange_commands.append(names)
+
+    resolved = set()
+    last_ticket = max((n for n, names in enumerate(exchange_commands) if "GENERAR_TICKET" in names), default=None)
+    for n, names in enumerate(exchange_commands):
+        if last_ticket is not None and n < last_ticket:
+            resolved.add(n)  # Belongs to an already completed blocking flow.
+        elif any(name in later for name in names for later in exchange_commands[n + 1:]):
+            resolved.add(n)  # A failed attempt that was retried later.
+
+    priorities = []
+    for n, names in enumerate(exchange_commands):
+        if n in resolved:
+            priorities.append(PRIORITY_RESOLVED)
+        elif names:
+            priorities.append(PRIORITY_COMMAND)
+        else:
+            priorities.append(PRIORITY_NORMAL)
+    return priorities
+
+
+def _with_summary(context, summary):
+    # Merged into the first user message so the context never has two user turns in a row.
+    if not summary:
+        return context
+    if context and context[0]["role"] == "user":
+        return [{"role": "user", "content": f"{summary}\n\n{context[0]['content']}"}] + context[1:]
+    return [{"role": "user", "content": summary}] + context
+
+
+def build_context(messages, facts=None, token_budget=CONTEXT_TOKEN_BUDGET):
+    messages = [{"role": m["role"], "content": m["content"]} for m in messages]
+    summary = build_facts_summary(extract_facts(messages, facts))
+
+    # Whole exchanges are dropped, so no bare "si" or reply is left without its question and command.
+    exchanges = _split_exchanges(messages)
+    priorities = _exchange_priorities(messages, exchanges)
+    costs = [sum(estimate_tokens(messages[i]["content"]) for i in exchange) for exchange in exchanges]
+    total = sum(costs) + (estimate_tokens(summary) if summary else 0)
+
+    kept = set(range(len(exchanges)))
+    # The current exchange is always sent, and so is the previous one: it holds the question the
+    # user is answering.
+    droppable = sorted(range(len(exchanges) - 2), key=lambda n: (priorities[n], n))
+    for n in droppable:
+        if total <= token_budget:
+            break
+        kept.discard(n)
+        total -= costs[n]
+
+    context = [messages[i] for n in sorted(kept) for i in exchanges[n]]
+    return _with_summary(context, summary)
@@ -0,0 +1,409 @@
+from supabase_config import create_async_supabase
+from command_parser import parse_response
+from telemetry import db_span, bind_current_span
+from startup import cached_resource
+import asyncio
+import atexit
+import concurrent.futures
+import datetime
+import fcntl
+import json
+import logging
+import os
+import threading
+import uuid
+
+# --- Configuration ---
+WRITE_QUEUE_MAX_SIZE = int(os.getenv("DB_WRITE_QUEUE_MAX_SIZE", "1000"))
+WRITE_BATCH_MAX_SIZE = int(os.getenv("DB_WRITE_BATCH_MAX_SIZE", "100"))
+WRITE_FLUSH_INTERVAL_SECONDS = float(os.getenv("DB_WRITE_FLUSH_INTERVAL", "0.5"))
+WRITE_MAX_ATTEMPTS = 3
+WRITE_RETRY_MAX_DELAY_SECONDS = 5.0
+SHUTDOWN_FLUSH_TIMEOUT_SECONDS = 10.0
+REQUEST_TIMEOUT_SECONDS = 30.0
+MESSAGES_PAGE_SIZE = int(os.getenv("MESSAGES_PAGE_SIZE", "50"))
+# The sidebar only shows these; select("*") would also ship documents and names.
+TICKET_PANEL_COLUMNS = "ticket_number, status, created_at"
+# Each process keeps its own journal file in this directory (see WriteJournal).
+JOURNAL_DIR = os.getenv("DB_WRITE_JOURNAL_DIR", ".telcobot_journal")
+REPLAY_LOCK_NAME = "replay.lock"
+
+logger = logging.getLogger(__name__)
+
+
+def _is_permanent_error(error):
+    # Integrity violations (class 23, e.g. FK to a deleted conversation) will never succeed on retry.
+    return str(getattr(error, "code", "") or "").startswith("23")
+
+
+def to_message(role, content, created_at=None, is_command=None):
+    # Display text is computed once here so reruns never re-parse the history.
+    parsed = parse_response(content)
+    if is_command is None:
+        is_command = parsed.is_command
+    return {
+        "role": role,
+        "content": content,
+        "is_command": is_command,
+        "created_at": created_at,
+        "display": None if is_command else (parsed.text if parsed.text is not None else content),
+    }
+
+
+def _parse_timestamp(value):
+    return datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+
+class WriteJournal:
+    # Append-only local spool of messages that aren't confirmed in the DB yet. Rows are written
+    # here before they are queued, so a crash mid-flush loses nothing: they're replayed on startup.
+    # Every process writes its own file and holds an exclusive flock on "<file>.lock" while it
+    # runs; on startup only journals whose lock is free (owner process gone) are adopted.
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, f"pending-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl")
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._owner_lock = open(self.path + ".lock", "w")
+        fcntl.flock(self._owner_lock, fcntl.LOCK_EX)  # Released by the OS when the process exits.
+
+    @staticmethod
+    def _read(path):
+        entries = []
+        if not os.path.exists(path):
+            return entries
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # Torn last line from a crash mid-append.
+        return entries
+
+    def load(self):
+        # Orphaned journals are moved into this process's journal before they're deleted, so a
+        # crash during the replay doesn't lose them either. Starting processes take turns.
+        with self._lock, open(os.path.join(self.directory, REPLAY_LOCK_NAME), "w") as guard:
+            fcntl.flock(guard, fcntl.LOCK_EX)
+            for name in sorted(os.listdir(self.directory)):
+                lock_path = os.path.join(self.directory, name)
+                journal_path = lock_path[:-len(".lock")]
+                if not name.endswith(".jsonl.lock") or journal_path == self.path:
+                    continue
+                with open(lock_path, "a") as lock:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue  # Its process is still running.
+                    entries = self._read(journal_path)
+                    if entries:
+                        for entry in entries:
+                            self._pending[entry["journal_id"]] = entry
+                        self._rewrite()
+                        logger.info(f"Recuperados {len(entries)} mensajes pendientes de {os.path.basename(journal_path)}")
+                    if os.path.exists(journal_path):
+                        os.remove(journal_path)
+                    os.remove(lock_path)
+            return list(self._pending.values())
+
+    def append(self, entry):
+        with self._lock:
+            self._pending[entry["journal_id"]] = entry
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def remove(self, journal_ids):
+        with self._lock:
+            for journal_id in journal_ids:
+                self._pending.pop(journal_id, None)
+            self._rewrite()
+
+    def _rewrite(self):
+        # Caller holds self._lock.
+        if not self._pending:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for entry in self._pending.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class AsyncDataAccess:
+    def __init__(self, journal_dir=JOURNAL_DIR):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="telcobot-db", daemon=True)
+        self._thread.start()
+        self._journal = WriteJournal(journal_dir)
+        self._timestamp_lock = threading.Lock()
+        self._last_timestamp = None
+        self._client = None
+        self.run(self._setup())
+        replayed = self._journal.load()
+        if replayed:
+            self.run(self._replay(replayed))
+        self._writer_task = asyncio.run_coroutine_threadsafe(self._writer(), self._loop)
+
+    async def _setup(self):
+        self._queue = asyncio.Queue(maxsize=WRITE_QUEUE_MAX_SIZE)
+        self._has_data = asyncio.Event()
+        self._failed = []
+        self._flush_lock = asyncio.Lock()
+        self._client_lock = asyncio.Lock()
+
+    def run(self, coro, timeout=REQUEST_TIMEOUT_SECONDS):
+        return asyncio.run_coroutine_threadsafe(bind_current_span(coro), self._loop).result(timeout)
+
+    def _run_or(self, coro, fallback, action):
+        # Reads and turn flushes degrade like the old synchronous helpers instead of raising into
+        # the script. The coroutine isn't cancelled: an in-flight flush still completes later.
+        try:
+            return self.run(coro)
+        except concurrent.futures.TimeoutError:
+            logger.error(f"Tiempo de espera agotado {action} ({REQUEST_TIMEOUT_SECONDS:.0f}s)")
+            return fallback
+
+    async def _get_client(self):
+        async with self._client_lock:
+            if self._client is None:
+                self._client = await create_async_supabase()
+            return self._client
+
+    # --- Message writes ---
+    def _next_timestamp(self):
+        # Rows of one bulk insert would share the same DB now(); an explicit, strictly increasing
+        # created_at keeps the conversation order stable.
+        with self._timestamp_lock:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            if self._last_timestamp and now <= self._last_timestamp:
+                now = self._last_timestamp + datetime.timedelta(microseconds=1)
+            self._last_timestamp = now
+            return now
+
+    def queue_message(self, conversation_id, role, content, is_command=None):
+        entry = {
+            "journal_id": uuid.uuid4().hex,
+            "row": {
+                "conversation_id": conversation_id,
+                "role": role,
+                "content": content,
+                "created_at": self._next_timestamp().isoformat(),
+            },
+        }
+        self._journal.append(entry)
+        # The row is already journaled: if the queue stays full (DB down) past the timeout, the
+        # pending put still enqueues it later and the turn goes on instead of raising.
+        self._run_or(self._enqueue(entry), None, "encolando un mensaje")
+        return to_message(role, content, entry["row"]["created_at"], is_command)
+
+    async def _enqueue(self, entry):
+        # Waits while the queue is full (backpressure) instead of dropping messages.
+        await self._queue.put(entry)
+        self._has_data.set()
+
+    async def _writer(self):
+        # Background flush for writes that aren't followed by an explicit finish_turn().
+        while True:
+            await self._has_data.wait()
+            await asyncio.sleep(WRITE_FLUSH_INTERVAL_SECONDS)
+            self._has_data.clear()
+            await self._flush()
+
+    async def _flush(self):
+        async with self._flush_lock:
+            pending, self._failed = self._failed, []
+            attempts = 0
+            while pending or not self._queue.empty():
+                while not self._queue.empty() and len(pending) < WRITE_BATCH_MAX_SIZE:
+                    pending.append(self._queue.get_nowait())
+                batch, pending = pending[:WRITE_BATCH_MAX_SIZE], pending[WRITE_BATCH_MAX_SIZE:]
+                try:
+                    client = await self._get_client()
+                    with db_span("messages", "insert", rows=len(batch), attempt=attempts + 1):
+                        await client.table("messages").insert([entry["row"] for entry in batch]).execute()
+                except Exception as e:
+                    if _is_permanent_error(e):
+                        # Batches mix rows of every session: isolate the offending rows instead of
+                        # dropping the whole batch.
+                        logger.warning(f"Error permanente en un lote de {len(batch)} mensajes, se reintenta fila por fila: {e}")
+                        done, batch, e = await self._insert_rows(batch)
+                        await self._journal_remove(done)
+                        if not batch:
+                            continue
+                    attempts += 1
+                    if attempts >= WRITE_MAX_ATTEMPTS:
+                        # Kept in memory and in the journal; the next flush starts with them.
+                        logger.warning(f"Error guardando mensajes, se reintentará en el próximo vaciado: {e}")
+                        self._failed = batch + pending
+                        self._has_data.set()
+                        return
+                    await asyncio.sleep(min(0.5 * 2 ** attempts, WRITE_RETRY_MAX_DELAY_SECONDS))
+                    pending = batch + pending
+                    continue
+                await self._journal_remove([entry["journal_id"] for entry in batch])
+
+    async def _journal_remove(self, journal_ids):
+        # The rewrite + fsync runs off the event loop so it doesn't stall the other DB coroutines.
+        await asyncio.get_running_loop().run_in_executor(None, self._journal.remove, journal_ids)
+
+    async def _insert_rows(self, batch):
+        # Row-by-row insert after a permanent batch error. Returns (journal ids that are done,
+        # entries still pending after a transient error, that error); failing rows are dropped.
+        done = []
+        for i, entry in enumerate(batch):
+            try:
+                client = await self._get_client()
+                with db_span("messages", "insert", rows=1, purpose="isolate"):
+                    await client.table("messages").insert(entry["row"]).execute()
+            except Exception as e:
+                if not _is_permanent_error(e):
+                    return done, batch[i:], e
+                logger.error(f"Error permanente guardando un mensaje de la conversación {entry['row']['conversation_id']}, se descarta: {e}")
+            done.append(entry["journal_id"])
+        return done, [], None
+
+    async def _replay(self, entries):
+        # A crash right after the insert but before the journal was trimmed would replay rows that
+        # already exist; they are matched by (conversation_id, created_at) and skipped.
+        try:
+            client = await self._get_client()
+            with db_span("messages", "select", purpose="replay", rows=len(entries)):
+                response = await client.table("messages").select("conversation_id, created_at").in_(
+                    "conversation_id", list({entry["row"]["conversation_id"] for entry in entries})
+                ).in_("created_at", [entry["row"]["created_at"] for entry in entries]).execute()
+            stored = {(row["conversation_id"], _parse_timestamp(row["created_at"])) for row in response.data or []}
+        except Exception as e:
+            logger.error(f"Error verificando mensajes pendientes del journal: {e}")
+            stored = set()
+        already_saved = []
+        for entry in entries:
+            key = (entry["row"]["conversation_id"], _parse_timestamp(entry["row"]["created_at"]))
+            if key in stored:
+                already_saved.append(entry["journal_id"])
+            else:
+                self._failed.append(entry)
+        await self._journal_remove(already_saved)
+        await self._flush()
+
+    def flush(self, timeout=REQUEST_TIMEOUT_SECONDS):
+        self.run(self._flush(), timeout)
+
+    # --- Conversation writes ---
+    async def _rename_conversation(self, conversation_id, new_title):
+        try:
+            client = await self._get_client()
+            with db_span("conversations", "update"):
+                await client.table("conversations").update({"title": new_title, "updated_at": "now()"}).eq("id", conversation_id).execute()
+        except Exception as e:
+            logger.error(f"Error renombrando conversación {conversation_id}: {e}")
+
+    async def _finish_turn(self, conversation_id, new_title):
+        tasks = [self._flush()]
+        if new_title:
+            tasks.append(self._rename_conversation(conversation_id, new_title))
+        await asyncio.gather(*tasks)
+
+    def finish_turn(self, conversation_id, new_title=None):
+        # One bulk insert for the turn's messages, concurrently with the optional rename.
+        # On timeout the messages stay queued and journaled; the background writer retries them.
+        self._run_or(self._finish_turn(conversation_id, new_title), None, "guardando el turno")
+
+    def rename_conversation(self, conversation_id, new_title):
+        self._run_or(self._rename_conversation(conversation_id, new_title), None, "renombrando la conversación")
+
+    # --- Reads ---
+    async def _fetch_messages(self, conversation_id, limit=None, before=None, after=None):
+        # limit/before page backwards from the newest message; after only pulls newer messages.
+        await self._flush()  # Reads must see this process's own queued writes.
+        try:
+            client = await self._get_client()
+            query = client.table("messages").select("role, content, created_at").eq("conversation_id", conversation_id)
+            if before:
+                query = query.lt("created_at", before)
+            if after:
+                query = query.gt("created_at", after)
+            with db_span("messages", "select", limit=limit, incremental=bool(after)) as op:
+                if limit:
+                    # One extra row tells whether an older page exists.
+                    response = await query.order("created_at", desc=True).limit(limit + 1).execute()
+                    rows = response.data or []
+                    has_more = len(rows) > limit
+                    rows = list(reversed(rows[:limit]))
+                else:
+                    response = await query.order("created_at", desc=False).execute()
+                    rows = response.data or []
+                    has_more = False
+                op.set(rows=len(rows))
+            return [to_message(row["role"], row["content"], row["created_at"]) for row in rows], has_more
+        except Exception as e:
+            logger.error(f"Error obteniendo mensajes: {e}")
+            return [], False
+
+    async def _fetch_tickets(self, conversation_id):
+        try:
+            client = await self._get_client()
+            with db_span("tickets", "select"):
+                response = await client.table("tickets").select(TICKET_PANEL_COLUMNS).eq("conversation_id", conversation_id).order("created_at", desc=True).execute()
+            return response.data or []
+        except Exception as e:
+            logger.error(f"Error obteniendo tickets: {e}")
+            return []
+
+    async def _fetch_conversations(self, session_id):
+        try:
+            client = await self._get_client()
+            with db_span("conversations", "select"):
+                response = await client.table("conversations").select("id, title, created_at, updated_at").eq("session_id", session_id).order("updated_at", desc=True).execute()
+            return response.data or []
+        except Exception as e:
+            logger.error(f"Error obteniendo conversaciones: {e}")
+            return []
+
+    async def _load_conversation(self, conversation_id, limit):
+        (messages, has_more), tickets = await asyncio.gather(
+            self._fetch_messages(conversation_id, limit=limit),
+            self._fetch_tickets(conversation_id),
+        )
+        return messages, has_more, tickets
+
+    def get_messages(self, conversation_id):
+        return self._run_or(self._fetch_messages(conversation_id), ([], False), "obteniendo mensajes")[0]
+
+    def get_messages_page(self, conversation_id, limit=MESSAGES_PAGE_SIZE, before=None):
+        return self._run_or(self._fetch_messages(conversation_id, limit=limit, before=before), ([], False), "obteniendo mensajes")
+
+    def get_messages_since(self, conversation_id, after):
+        return self._run_or(self._fetch_messages(conversation_id, after=after), ([], False), "obteniendo mensajes")[0]
+
+    def get_tickets(self, conversation_id):
+        return self._run_or(self._fetch_tickets(conversation_id), [], "obteniendo tickets")
+
+    def get_conversations(self, session_id):
+        return self._run_or(self._fetch_conversations(session_id), [], "obteniendo conversaciones")
+
+    def load_conversation(self, conversation_id, limit=MESSAGES_PAGE_SIZE):
+        # Latest page of messages and the tickets are independent, so they're fetched concurrently.
+        return self._run_or(self._load_conversation(conversation_id, limit), ([], False, []), "cargando la conversación")
+
+    def shutdown(self):
+        try:
+            self.flush(timeout=SHUTDOWN_FLUSH_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.error(f"Error vaciando la cola de mensajes al cerrar (quedan en el journal): {e}")
+
+
+@cached_resource("data_access")
+def get_data_access():
+    data_access = AsyncDataAccess()
+    atexit.register(data_access.shutdown)
+    return data_access
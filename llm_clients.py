@@ -0,0 +1,149 @@
+from startup import lazy_import
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# --- Pool Configuration ---
+POOL_MAX_SIZE = int(os.getenv("LLM_POOL_MAX_SIZE", "32"))
+POOL_IDLE_TTL_SECONDS = float(os.getenv("LLM_POOL_IDLE_TTL", "600"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "10"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("LLM_HTTP_TIMEOUT", "60"))
+
+logger = logging.getLogger(__name__)
+
+# genai.configure() mutates module-level state, so building Gemini clients must be serialized.
+genai_config_lock = threading.Lock()
+
+
+def hash_api_key(api_key):
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+def _build_openai_client(api_key, model):
+    httpx = lazy_import("httpx")
+    openai = lazy_import("openai")
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+        timeout=HTTP_TIMEOUT_SECONDS,
+    )
+    return openai.OpenAI(api_key=api_key, http_client=http_client)
+
+
+def _build_gemini_client(api_key, model, system_instruction, cached_content=None):
+    genai = lazy_import("google.generativeai")
+    genai_client = lazy_import("google.generativeai.client")
+    with genai_config_lock:
+        genai.configure(api_key=api_key)
+        if cached_content is not None:
+            # The system instruction already lives in the provider-side cache.
+            gemini_model = genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+        else:
+            gemini_model = genai.GenerativeModel(model, system_instruction=system_instruction)
+        # Bind the transport created for this key now; otherwise the model would lazily pick up
+        # whatever key was configured last by another session.
+        gemini_model._client = genai_client.get_default_generative_client()
+    return gemini_model
+
+
+def _close_client(client):
+    close = getattr(client, "close", None)
+    if callable(close):
+        try:
+            close()
+        except Exception as e:
+            logger.warning(f"Error cerrando cliente LLM: {e}")
+
+
+class ClientPool:
+    def __init__(self, max_size=POOL_MAX_SIZE, idle_ttl=POOL_IDLE_TTL_SECONDS):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._clients = OrderedDict()  # key -> [client, last_used]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, provider, api_key, model, system_instruction=None, cached_content=None):
+        key = (provider, hash_api_key(api_key), model, cached_content.name if cached_content is not None else None)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                entry[1] = now
+                self._clients.move_to_end(key)
+                self.hits += 1
+                client = entry[0]
+            else:
+                self.misses += 1
+                client = None
+        if client is not None:
+            return client
+
+        # Build outside the pool lock so a slow client construction doesn't block other sessions.
+        if provider == "gemini":
+            client = _build_gemini_client(api_key, model, system_instruction, cached_content)
+        elif provider == "openai":
+            client = _build_openai_client(api_key, model)
+        else:
+            raise ValueError(f"Proveedor LLM '{provider}' no soportado.")
+
+        duplicate = None
+        with self._lock:
+            existing = self._clients.get(key)
+            if existing is not None:
+                # Another thread built the same client concurrently; keep the first one.
+                duplicate = client
+                existing[1] = now
+                client = existing[0]
+            else:
+                self._clients[key] = [client, now]
+                while len(self._clients) > self.max_size:
+                    self._clients.popitem(last=False)
+                    self.evictions += 1
+        if duplicate is not None:
+            _close_client(duplicate)  # Never handed out, so nobody is using it.
+        return client
+
+    def _evict_idle(self, now):
+        # Evicted clients are only dropped from the pool, never closed here: another session may
+        # still be in the middle of a request or stream with them. They're released once unreferenced.
+        for key in [k for k, (_, last_used) in self._clients.items() if now - last_used > self.idle_ttl]:
+            del self._clients[key]
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            clients = [client for client, _ in self._clients.values()]
+            self._clients.clear()
+        for client in clients:
+            _close_client(client)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._clients),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "reuse_rate": self.hits / total if total else 0.0,
+            }
+
+
+# Process-wide pool shared by every Streamlit session and thread.
+client_pool = ClientPool()
+
+
+def get_llm_client(provider, api_key, model, system_instruction=None, cached_content=None):
+    return client_pool.get(provider, api_key, model, system_instruction, cached_content)
+
+
+def get_pool_stats():
+    return client_pool.stats()
@@ -0,0 +1,312 @@
+from llm_clients import hash_api_key
+import contextvars
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# --- Configuration ---
+# Requests per second and burst size of the token bucket for each (provider, API key).
+RATE_LIMITS = {
+    "gemini": float(os.getenv("LLM_RATE_LIMIT_GEMINI", "10")),
+    "openai": float(os.getenv("LLM_RATE_LIMIT_OPENAI", "10")),
+}
+RATE_BURST = int(os.getenv("LLM_RATE_BURST", "20"))
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# Max wait for a rate-limit token or a concurrency slot before giving up on a provider.
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# Hedging: if the first provider hasn't answered (first chunk, for streams) within its recent p95,
+# the same request is sent to the other provider and the first to answer wins. Needs the other
+# provider's key in GEMINI_API_KEY / OPENAI_API_KEY.
+HEDGE_ENABLED = os.getenv("LLM_HEDGE", "0") == "1"
+HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "3"))
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LATENCY_SAMPLE_SIZE = 200
+FALLBACK_KEYS = {"gemini": os.getenv("GEMINI_API_KEY"), "openai": os.getenv("OPENAI_API_KEY")}
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {
+    # openai / httpx
+    "RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+    "TimeoutException", "ConnectError", "ReadTimeout", "RemoteProtocolError",
+    # google.api_core
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "TooManyRequests", "InternalServerError",
+}
+
+logger = logging.getLogger(__name__)
+
+
+class LLMUnavailableError(Exception):
+    pass
+
+
+def is_retryable(error):
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    for attribute in ("status_code", "code"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int) and status in RETRYABLE_STATUS_CODES:
+            return True
+    return False
+
+
+def can_fail_over(error):
+    # Only transient failures and timeouts move a request to the operator's key. Auth and
+    # validation errors (e.g. a wrong user-supplied key) surface as they are.
+    return is_retryable(error) or isinstance(error, (TimeoutError, LLMUnavailableError))
+
+
+def backoff_delay(attempt):
+    # Exponential with full jitter, so sessions that failed together don't retry together.
+    return random.uniform(0, min(RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1), RETRY_MAX_DELAY_SECONDS))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait_seconds = (1 - self._tokens) / self.rate
+            if time.monotonic() + wait_seconds > deadline:
+                return False
+            time.sleep(wait_seconds)
+
+
+class LLMDispatcher:
+    def __init__(self, hedge_enabled=HEDGE_ENABLED, fallback_keys=None):
+        self.hedge_enabled = hedge_enabled
+        self.fallback_keys = FALLBACK_KEYS if fallback_keys is None else fallback_keys
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._slots = defaultdict(lambda: threading.BoundedSemaphore(MAX_CONCURRENCY))
+        self._latencies = defaultdict(lambda: deque(maxlen=LATENCY_SAMPLE_SIZE))
+        self._executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY * 2, thread_name_prefix="telcobot-llm")
+        self.counters = defaultdict(int)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _bucket(self, provider, api_key):
+        key = (provider, hash_api_key(api_key))
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(RATE_LIMITS.get(provider, 10.0), RATE_BURST)
+            return self._buckets[key]
+
+    def _acquire(self, provider, api_key):
+        # Returns with a concurrency slot held; the caller releases it.
+        if not self._bucket(provider, api_key).acquire(QUEUE_TIMEOUT_SECONDS):
+            self._count(f"rate_limited:{provider}")
+            raise LLMUnavailableError(f"Límite de solicitudes de {provider} alcanzado.")
+        if not self._slots[provider].acquire(timeout=QUEUE_TIMEOUT_SECONDS):
+            self._count(f"saturated:{provider}")
+            raise LLMUnavailableError(f"Sin capacidad disponible para {provider}.")
+
+    def _record_latency(self, provider, kind, seconds):
+        with self._lock:
+            self._latencies[(provider, kind)].append(seconds)
+
+    def hedge_delay(self, provider, kind):
+        with self._lock:
+            samples = sorted(self._latencies[(provider, kind)])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY_SECONDS
+        return samples[min(int(0.95 * len(samples)), len(samples) - 1)]
+
+    def _fallback(self, provider):
+        if not self.hedge_enabled:
+            return None
+        for other, key in self.fallback_keys.items():
+            if other != provider and key:
+                return other, key
+        return None
+
+    # --- Non-streaming calls ---
+    def _call_with_retries(self, provider, api_key, call):
+        attempt = 0
+        while True:
+            attempt += 1
+            self._acquire(provider, api_key)
+            try:
+                return call(provider, api_key)
+            except Exception as e:
+                if attempt >= MAX_ATTEMPTS or not is_retryable(e):
+                    raise
+                logger.warning(f"Error reintentable de {provider} (intento {attempt}/{MAX_ATTEMPTS}): {e}")
+                self._count(f"retries:{provider}")
+            finally:
+                self._slots[provider].release()
+            time.sleep(backoff_delay(attempt))
+
+    def _submit(self, provider, api_key, call):
+        started = time.monotonic()
+        # Each task runs in a copy of the caller's context so its spans nest under the turn.
+        future = self._executor.submit(contextvars.copy_context().run, self._call_with_retries, provider, api_key, call)
+        return future, (provider, started)
+
+    def complete(self, provider, api_key, call):
+        # call(provider, api_key) -> response; raises the last error when every provider failed.
+        self._count(f"calls:{provider}")
+        fallback = self._fallback(provider)
+        future, source = self._submit(provider, api_key, call)
+        pending = {future: source}
+        if fallback:
+            done, _ = wait(pending, timeout=self.hedge_delay(provider, "complete"))
+            if not done:
+                self._count("hedges")
+                future, source = self._submit(*fallback, call)
+                pending[future] = source
+                fallback = None
+        error = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider_done, started = pending.pop(future)
+                if future.exception() is None:
+                    self._record_latency(provider_done, "complete", time.monotonic() - started)
+                    self._count(f"wins:{provider_done}")
+                    return future.result()
+                error = future.exception()
+                self._count(f"failures:{provider_done}")
+                if provider_done == provider and not can_fail_over(error):
+                    # Don't let a hedged request already running on the operator's key answer it.
+                    for other in pending:
+                        other.cancel()
+                    raise error
+            if not pending and fallback:
+                # The first provider failed outright: fail over instead of surfacing the error.
+                self._count("failovers")
+                future, source = self._submit(*fallback, call)
+                pending[future] = source
+                fallback = None
+        raise error
+
+    # --- Streaming calls ---
+    def _stream_worker(self, provider, api_key, open_stream, out, stop):
+        # Pushes ("chunk", provider, text), then ("done", provider, None) or ("error", provider, e).
+        # Retries only before the first chunk: a partially shown answer can't be replayed.
+        attempt = 0
+        try:
+            while True:
+                attempt += 1
+                self._acquire(provider, api_key)
+                started = False
+                stream = None
+                try:
+                    stream = open_stream(provider, api_key)
+                    for chunk in stream:
+                        if stop.is_set():
+                            return
+                        started = True
+                        out.put(("chunk", provider, chunk))
+                    out.put(("done", provider, None))
+                    return
+                except Exception as e:
+                    if started or attempt >= MAX_ATTEMPTS or not is_retryable(e) or stop.is_set():
+                        raise
+                    logger.warning(f"Error reintentable de {provider} (intento {attempt}/{MAX_ATTEMPTS}): {e}")
+                    self._count(f"retries:{provider}")
+                finally:
+                    if stream is not None and hasattr(stream, "close"):
+                        stream.close()
+                    self._slots[provider].release()
+                time.sleep(backoff_delay(attempt))
+        except Exception as e:
+            out.put(("error", provider, e))
+
+    def _start_stream(self, provider, api_key, open_stream, out):
+        stop = threading.Event()
+        worker = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._stream_worker, provider, api_key, open_stream, out, stop),
+            name=f"telcobot-llm-{provider}", daemon=True,
+        )
+        worker.start()
+        return stop, time.monotonic()
+
+    def stream(self, provider, api_key, open_stream):
+        # open_stream(provider, api_key) -> iterable of text chunks. The first provider to produce a
+        # chunk wins; the other one is told to stop.
+        self._count(f"calls:{provider}")
+        fallback = self._fallback(provider)
+        out = queue.Queue()
+        running = {provider: self._start_stream(provider, api_key, open_stream, out)}
+        hedge_at = time.monotonic() + self.hedge_delay(provider, "stream") if fallback else None
+        winner, error = None, None
+        try:
+            while True:
+                timeout = None
+                if winner is None and fallback:
+                    timeout = max(hedge_at - time.monotonic(), 0)
+                try:
+                    kind, source, payload = out.get(timeout=timeout)
+                except queue.Empty:
+                    self._count("hedges")
+                    running[fallback[0]] = self._start_stream(*fallback, open_stream, out)
+                    fallback = None
+                    continue
+                if winner is None:
+                    if kind == "error":
+                        error = payload
+                        self._count(f"failures:{source}")
+                        running.pop(source)
+                        if source == provider and not can_fail_over(error):
+                            raise error  # The finally block stops a hedged stream on the operator's key.
+                        if fallback:
+                            self._count("failovers")
+                            running[fallback[0]] = self._start_stream(*fallback, open_stream, out)
+                            fallback = None
+                        if not running:
+                            raise error
+                        continue
+                    winner = source
+                    self._record_latency(winner, "stream", time.monotonic() - running[winner][1])
+                    self._count(f"wins:{winner}")
+                    for other, (stop, _) in running.items():
+                        if other != winner:
+                            stop.set()
+                if source != winner:
+                    continue
+                if kind == "chunk":
+                    yield payload
+                elif kind == "done":
+                    return
+                else:
+                    raise payload
+        finally:
+            for stop, _ in running.values():
+                stop.set()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        counters["hedge_delay_s"] = {provider: round(self.hedge_delay(provider, "stream"), 3) for provider in RATE_LIMITS}
+        return counters
+
+
+llm_dispatcher = LLMDispatcher()
+
+
+def get_dispatch_stats():
+    return llm_dispatcher.stats()
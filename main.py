@@ -1,13 +1,31 @@
-import streamlit as st
-from chat_utils import (
-    get_llm_response,
-    save_message, get_messages_for_conversation,
-    create_conversation, get_user_conversations,
-    delete_conversation_and_messages, rename_conversation,
-    process_llm_command, get_tickets_by_conversation
-)
+from startup import startup_report, timed_import, get_startup_report
+import time
+# Tiempo de importación por módulo (incluye sus dependencias) para el reporte de arranque
+with timed_import("streamlit"):
+    import streamlit as st
+with timed_import("chat_utils"):
+    from chat_utils import (
+        get_messages_page, get_messages_since,
+        create_conversation,
+        delete_conversation_and_messages,
+        get_user_cache_stats
+    )
+with timed_import("chat_turn"):
+    from chat_turn import run_chat_turn
+with timed_import("app_modules"):
+    from llm_clients import get_pool_stats
+    from llm_dispatch import get_dispatch_stats
+    from prompt_cache import get_prompt_cache_stats
+    from response_cache import get_response_cache_stats
+    from state_engine import FlowState, get_fast_path_metrics
+    from telemetry import get_trace_summary
+    from sidebar_cache import SidebarCache
+import logging
+import os
 import uuid
-import re
+
+# --- Logging (reemplaza los print de consola; el contenido sensible se enmascara) ---
+logging.basicConfig(level=os.getenv("TELCOBOT_LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s [%(name)s] %(message)s")
 
 # --- Page Configuration ---
 st.set_page_config(page_title="TelcoBot - Bloqueos", layout="wide", initial_sidebar_state="auto")
@@ -16,8 +34,9 @@ st.set_page_config(page_title="TelcoBot - Bloqueos", layout="wide", initial_side
 def init_session_state():
     if "session_id" not in st.session_state:
         st.session_state.session_id = str(uuid.uuid4())
-    if "conversations_list" not in st.session_state:
-        st.session_state.conversations_list = []
+    if "sidebar_cache" not in st.session_state:
+        # Lista de conversaciones y tickets de la sesión; solo se consulta la BD cuando cambian
+        st.session_state.sidebar_cache = SidebarCache(st.session_state.session_id)
     if "active_conversation_id" not in st.session_state:
         st.session_state.active_conversation_id = None
     if "messages" not in st.session_state:
@@ -26,8 +45,14 @@ def init_session_state():
         st.session_state.api_key = None
     if "selected_provider" not in st.session_state:
         st.session_state.selected_provider = "gemini"
-    if "conversations_loaded" not in st.session_state:
-        st.session_state.conversations_loaded = False
+    if "messages_has_more" not in st.session_state:
+        st.session_state.messages_has_more = False
+    if "loaded_conversations" not in st.session_state:
+        st.session_state.loaded_conversations = {}
+    if "flow_states" not in st.session_state:
+        st.session_state.flow_states = {}
+    if "fast_path_enabled" not in st.session_state:
+        st.session_state.fast_path_enabled = os.getenv("TELCOBOT_FAST_PATH", "1") == "1"
 
 init_session_state()
 
@@ -35,13 +60,32 @@ init_session_state()
 def switch_to_conversation(conv_id, conv_title):
     st.session_state.active_conversation_id = conv_id
     st.session_state.active_conversation_title = conv_title
-    st.session_state.messages = get_messages_for_conversation(conv_id)
-
-def extract_conversational_response(text):
-    match = re.search(r'<respuesta_conversacional>(.*?)</respuesta_conversacional>', text, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    return text # Devuelve el texto original si no encuentra la etiqueta, como fallback
+    cached = st.session_state.loaded_conversations.get(conv_id)
+    if cached:
+        # Ya cargada en esta sesión: solo se traen los mensajes más nuevos que el último visto
+        last_seen = next((m["created_at"] for m in reversed(cached["messages"]) if m.get("created_at")), None)
+        if last_seen:
+            cached["messages"].extend(get_messages_since(conv_id, last_seen))
+    else:
+        # Última página de mensajes y tickets se consultan en paralelo
+        messages, has_more = st.session_state.sidebar_cache.load_conversation(conv_id)
+        cached = {"messages": messages, "has_more": has_more}
+        st.session_state.loaded_conversations[conv_id] = cached
+    st.session_state.messages = cached["messages"]
+    st.session_state.messages_has_more = cached["has_more"]
+    get_flow_state(conv_id)
+
+def load_older_messages(conv_id):
+    cached = st.session_state.loaded_conversations[conv_id]
+    oldest = cached["messages"][0]["created_at"] if cached["messages"] else None
+    older, cached["has_more"] = get_messages_page(conv_id, before=oldest)
+    cached["messages"][:0] = older
+    st.session_state.messages_has_more = cached["has_more"]
+
+def get_flow_state(conv_id):
+    if conv_id not in st.session_state.flow_states:
+        st.session_state.flow_states[conv_id] = FlowState.for_history(st.session_state.messages)
+    return st.session_state.flow_states[conv_id]
 
 # --- UI Sidebar ---
 with st.sidebar:
@@ -51,7 +95,7 @@ with st.sidebar:
     if st.button("➕ Nueva Solicitud", use_container_width=True):
         new_conv = create_conversation(st.session_state.session_id)
         if new_conv:
-            st.session_state.conversations_list.insert(0, new_conv)
+            st.session_state.sidebar_cache.add_conversation(new_conv)
             switch_to_conversation(new_conv["id"], new_conv["title"])
             st.rerun()
         else:
@@ -60,15 +104,15 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("#### Mis Solicitudes")
 
-    if not st.session_state.conversations_loaded:
-        st.session_state.conversations_loaded = True
-        st.session_state.conversations_list = get_user_conversations(st.session_state.session_id)
-        if st.session_state.conversations_list and not st.session_state.active_conversation_id:
-            conv = st.session_state.conversations_list[0]
-            switch_to_conversation(conv["id"], conv["title"])
+    request_start = time.perf_counter()
+    conversations = st.session_state.sidebar_cache.conversations()
+    startup_report.record_first_request("conversations", time.perf_counter() - request_start)
+    if conversations and not st.session_state.active_conversation_id:
+        conv = conversations[0]
+        switch_to_conversation(conv["id"], conv["title"])
         st.rerun()
 
-    for conv in st.session_state.conversations_list:
+    for conv in conversations:
         is_active = conv["id"] == st.session_state.active_conversation_id
         col1, col2 = st.columns([0.8, 0.2])
         if col1.button(f"{'▶️ ' if is_active else '💬 '} {conv['title']}", key=f"conv_{conv['id']}", use_container_width=True, type="primary" if is_active else "secondary"):
@@ -76,16 +120,22 @@ with st.sidebar:
                 switch_to_conversation(conv["id"], conv["title"])
                 st.rerun()
         if col2.button("🗑️", key=f"del_{conv['id']}", help="Borrar solicitud"):
-            delete_conversation_and_messages(conv["id"])
-            st.session_state.active_conversation_id = None
-            st.session_state.messages = []
-            st.session_state.conversations_loaded = False
-            st.rerun()
+            if delete_conversation_and_messages(conv["id"]):
+                # Se quita de la lista local sin volver a consultar todas las conversaciones
+                st.session_state.sidebar_cache.remove_conversation(conv["id"])
+                st.session_state.flow_states.pop(conv["id"], None)
+                st.session_state.loaded_conversations.pop(conv["id"], None)
+                if conv["id"] == st.session_state.active_conversation_id:
+                    st.session_state.active_conversation_id = None
+                    st.session_state.messages = []
+                st.rerun()
+            else:
+                st.error("Error al borrar. Revise la consola.")
     
     st.markdown("---")
     if st.session_state.active_conversation_id:
         st.markdown("#### Tickets Generados")
-        tickets = get_tickets_by_conversation(st.session_state.active_conversation_id)
+        tickets = st.session_state.sidebar_cache.tickets(st.session_state.active_conversation_id)
         if tickets:
             for ticket in tickets:
                 st.caption(f"🟢 `{ticket['ticket_number']}`")
@@ -97,6 +147,22 @@ with st.sidebar:
     provider_map = {"Gemini": "gemini", "OpenAI": "openai"}
     selected_provider_display = st.selectbox("Proveedor LLM", options=list(provider_map.keys()), index=0)
     st.session_state.selected_provider = provider_map[selected_provider_display]
+    st.session_state.fast_path_enabled = st.toggle("Ruta rápida (sin LLM en el flujo estándar)", value=st.session_state.fast_path_enabled)
+    with st.expander("Métricas de rendimiento"):
+        st.json({
+            "ruta_rapida": get_fast_path_metrics(),
+            "cache_usuarios": get_user_cache_stats(),
+            "cache_sidebar": st.session_state.sidebar_cache.stats(),
+            "pool_clientes_llm": get_pool_stats(),
+            "despacho_llm": get_dispatch_stats(),
+            "cache_prompt": get_prompt_cache_stats(),
+            "cache_respuestas": get_response_cache_stats(),
+            "trazas": get_trace_summary(),
+            "arranque": get_startup_report(),
+        })
+
+# Primera renderización completa del proceso: se registra el reporte de arranque una sola vez
+startup_report.mark_ready()
 
 
 # --- Main Chat Area ---
@@ -106,68 +172,49 @@ if not st.session_state.active_conversation_id:
 
 st.title(st.session_state.get("active_conversation_title", "TelcoBot"))
 
+if st.session_state.messages_has_more:
+    if st.button("⬆️ Cargar mensajes anteriores"):
+        load_older_messages(st.session_state.active_conversation_id)
+        st.rerun()
+
 # Bucle de visualización: Muestra solo el contenido limpio
 for msg in st.session_state.messages:
     # Solo mostramos mensajes que no son comandos internos
     if not msg.get("is_command", False):
         with st.chat_message(msg["role"]):
-            # Extraemos el texto limpio de la etiqueta para mostrarlo
-            st.markdown(extract_conversational_response(msg["content"]))
+            # El texto limpio se precalcula al cargar/guardar el mensaje
+            st.markdown(msg["display"])
 
 # --- Lógica de Chat ---
 if prompt := st.chat_input("Escribe tu mensaje aquí...", disabled=not st.session_state.api_key):
-    # 1. Guardar y mostrar mensaje del usuario
-    user_message = {"role": "user", "content": prompt}
-    st.session_state.messages.append(user_message)
-    save_message(st.session_state.active_conversation_id, "user", prompt)
+    # 1. Mostrar mensaje del usuario
     with st.chat_message("user"):
         st.markdown(prompt)
-    
-    print("\n" + "="*50)
-    print(f"🕵️  [CONSOLE LOG | USER]: {prompt}")
-
-    # 2. Bucle de procesamiento para manejar el flujo comando -> respuesta
-    with st.spinner("TelcoBot está procesando..."):
-        # Llamada inicial al LLM
-        llm_response = get_llm_response(st.session_state.messages, st.session_state.api_key, st.session_state.selected_provider)
-        print(f"🤖 [CONSOLE LOG | LLM Raw Response]: {llm_response}")
-
-        # Procesar si la respuesta es un comando
-        system_feedback = process_llm_command(llm_response, st.session_state.active_conversation_id)
-        
-        if system_feedback:
-            # Es un comando. Lo guardamos en el historial y en la BD
-            command_message = {"role": "assistant", "content": llm_response, "is_command": True}
-            st.session_state.messages.append(command_message)
-            save_message(st.session_state.active_conversation_id, "assistant", llm_response)
-            print(f"⚙️  [CONSOLE LOG | System Feedback]: {system_feedback}")
-            
-            # Creamos un mensaje de feedback para la siguiente llamada al LLM
-            feedback_message = {"role": "user", "content": system_feedback}
-            
-            # Hacemos la SEGUNDA llamada al LLM para obtener la respuesta conversacional
-            final_response_content = get_llm_response(st.session_state.messages + [feedback_message], st.session_state.api_key, st.session_state.selected_provider)
-            print(f"🗣️  [CONSOLE LOG | LLM Final Conversational Response]: {final_response_content}")
 
+    # 2. Procesar el turno (ruta rápida o LLM en streaming) mostrando los fragmentos a medida que llegan
+    flow = get_flow_state(st.session_state.active_conversation_id)
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        placeholder.caption("TelcoBot está procesando...")
+        turn_start = time.perf_counter()
+        result = run_chat_turn(
+            st.session_state.active_conversation_id, st.session_state.messages, prompt,
+            st.session_state.api_key, st.session_state.selected_provider, flow,
+            fast_path_enabled=st.session_state.fast_path_enabled,
+            conversation_title=st.session_state.get("active_conversation_title"),
+            on_text=lambda text: placeholder.markdown(text + "▌"),
+            on_wait=lambda: placeholder.caption("TelcoBot está procesando..."),
+        )
+        startup_report.record_first_request(f"chat_turn:{st.session_state.selected_provider}", time.perf_counter() - turn_start)
+        # Texto limpio final (reemplaza el texto parcial del streaming)
+        if result.bot_message:
+            placeholder.markdown(result.bot_message["display"])
         else:
-            # No es un comando, es una respuesta conversacional directa
-            final_response_content = llm_response
-
-    # 3. Guardar y mostrar la respuesta final del bot
-    if final_response_content:
-        bot_message = {"role": "assistant", "content": final_response_content, "is_command": False}
-        st.session_state.messages.append(bot_message)
-        save_message(st.session_state.active_conversation_id, "assistant", final_response_content)
-        
-        # Extraemos el texto limpio para mostrarlo en la UI
-        display_text = extract_conversational_response(final_response_content)
-        with st.chat_message("assistant"):
-            st.markdown(display_text)
-    
-    # 4. Renombrar conversación 
-    is_first_user_message = len([m for m in st.session_state.messages if m['role'] == 'user']) == 1
-    if is_first_user_message and st.session_state.get("active_conversation_title") == "Nueva Solicitud de Bloqueo":
-        new_title = prompt[:40] + "..." if len(prompt) > 40 else prompt
-        rename_conversation(st.session_state.active_conversation_id, new_title)
-    
-    st.rerun()
\ No newline at end of file
+            placeholder.empty()
+
+    # Los tickets nuevos invalidan el panel por versión; el título se actualiza en la lista local
+    if result.new_title:
+        st.session_state.sidebar_cache.rename_conversation(st.session_state.active_conversation_id, result.new_title)
+        st.session_state.active_conversation_title = result.new_title
+
+    st.rerun()
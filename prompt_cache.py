@@ -0,0 +1,181 @@
+from llm_clients import genai_config_lock, hash_api_key
+from startup import lazy_import
+import datetime
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+# --- Gemini Context Cache Configuration ---
+GEMINI_CACHE_ENABLED = os.getenv("GEMINI_PROMPT_CACHE", "1") == "1"
+GEMINI_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_PROMPT_CACHE_TTL", "3600"))
+# Extend the TTL when this close to expiry instead of letting the cache lapse between turns.
+GEMINI_CACHE_REFRESH_MARGIN_SECONDS = int(os.getenv("GEMINI_PROMPT_CACHE_REFRESH_MARGIN", "300"))
+# After a failed create (e.g. prompt below the provider's minimum size, unsupported model),
+# don't retry on every call.
+GEMINI_CACHE_RETRY_AFTER_SECONDS = int(os.getenv("GEMINI_PROMPT_CACHE_RETRY_AFTER", "600"))
+RECENT_USAGE_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+def is_cache_error(error):
+    # The cached content is gone: 404, or a rejection that names the cached content (e.g. expired).
+    # Rate limits, 5xx and timeouts aren't: those go back to llm_dispatch for retry/backoff.
+    if type(error).__name__ == "NotFound" or getattr(error, "code", None) == 404:
+        return True
+    return "cachedcontent" in str(error).lower().replace(" ", "").replace("_", "")
+
+
+class GeminiPromptCache:
+    def __init__(self):
+        self._entries = {}  # key -> {"cache": CachedContent, "expires_at": monotonic}
+        self._unavailable_until = {}
+        self._key_locks = {}  # key -> Lock held while that key's cache is created or refreshed
+        self._lock = threading.Lock()  # Guards the dicts and counters only, never a network call
+        self.created = 0
+        self.refreshed = 0
+        self.failures = 0
+
+    def _key(self, api_key, model, system_instruction):
+        return (hash_api_key(api_key), model, hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()[:16])
+
+    def get(self, api_key, model, system_instruction):
+        # Returns a CachedContent handle, or None when caching is off or unavailable.
+        if not GEMINI_CACHE_ENABLED:
+            return None
+        key = self._key(api_key, model, system_instruction)
+        now = time.monotonic()
+        with self._lock:
+            if self._unavailable_until.get(key, 0) > now:
+                return None
+            entry = self._entries.get(key)
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        fresh = entry is not None and entry["expires_at"] > now
+        if fresh and entry["expires_at"] - now >= GEMINI_CACHE_REFRESH_MARGIN_SECONDS:
+            return entry["cache"]
+        # Only one caller per key creates/refreshes (so no duplicate caches); the others don't wait
+        # for that network call: they use the current handle or send the full prompt.
+        if not key_lock.acquire(blocking=False):
+            return entry["cache"] if fresh else None
+        try:
+            with self._lock:
+                entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is None or entry["expires_at"] <= now:
+                entry = self._create(api_key, model, system_instruction)
+                with self._lock:
+                    self._entries[key] = entry
+            elif entry["expires_at"] - now < GEMINI_CACHE_REFRESH_MARGIN_SECONDS:
+                self._refresh(api_key, entry)
+            return entry["cache"]
+        except Exception as e:
+            logger.warning(f"Caché de contexto de Gemini no disponible, se envía el prompt completo: {e}")
+            with self._lock:
+                self.failures += 1
+                self._entries.pop(key, None)
+                self._unavailable_until[key] = time.monotonic() + GEMINI_CACHE_RETRY_AFTER_SECONDS
+            return None
+        finally:
+            key_lock.release()
+
+    def _create(self, api_key, model, system_instruction):
+        genai = lazy_import("google.generativeai")
+        caching = lazy_import("google.generativeai.caching")
+        ttl = datetime.timedelta(seconds=GEMINI_CACHE_TTL_SECONDS)
+        # The SDK reads the configured key when the call is made, so configure and create stay
+        # together; only building a new pooled client waits on this lock, not pooled turns.
+        with genai_config_lock:
+            genai.configure(api_key=api_key)
+            cache = caching.CachedContent.create(model=f"models/{model}", display_name="telcobot-system-prompt", system_instruction=system_instruction, ttl=ttl)
+        with self._lock:
+            self.created += 1
+        return {"cache": cache, "expires_at": time.monotonic() + GEMINI_CACHE_TTL_SECONDS}
+
+    def _refresh(self, api_key, entry):
+        genai = lazy_import("google.generativeai")
+        with genai_config_lock:
+            genai.configure(api_key=api_key)
+            entry["cache"].update(ttl=datetime.timedelta(seconds=GEMINI_CACHE_TTL_SECONDS))
+        entry["expires_at"] = time.monotonic() + GEMINI_CACHE_TTL_SECONDS
+        with self._lock:
+            self.refreshed += 1
+
+    def invalidate(self, api_key, model, system_instruction, cache):
+        # Called when a call with this handle hit a cache error (expired or deleted provider-side).
+        # Only drops it if it's still the current handle, and deletes it so it stops costing storage.
+        key = self._key(api_key, model, system_instruction)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["cache"] is not cache:
+                return
+            del self._entries[key]
+        genai = lazy_import("google.generativeai")
+        try:
+            with genai_config_lock:
+                genai.configure(api_key=api_key)
+                cache.delete()
+        except Exception as e:
+            logger.info(f"No se pudo borrar la caché de contexto anterior de Gemini: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {"active": len(self._entries), "created": self.created, "refreshed": self.refreshed, "failures": self.failures}
+
+
+gemini_prompt_cache = GeminiPromptCache()
+
+
+# --- Token usage per call (cached prompt tokens included) ---
+class PromptUsageStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = defaultdict(lambda: {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+        self._recent = deque(maxlen=RECENT_USAGE_SIZE)
+
+    def record(self, provider, model, prompt_tokens, cached_tokens, completion_tokens):
+        prompt_tokens, cached_tokens, completion_tokens = prompt_tokens or 0, cached_tokens or 0, completion_tokens or 0
+        with self._lock:
+            totals = self._totals[f"{provider}:{model}"]
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["cached_tokens"] += cached_tokens
+            totals["completion_tokens"] += completion_tokens
+            usage = {"prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens, "completion_tokens": completion_tokens}
+            self._recent.append(dict(usage, provider=provider, model=model))
+            return usage
+
+    def snapshot(self):
+        with self._lock:
+            report = {}
+            for name, totals in self._totals.items():
+                prompt = totals["prompt_tokens"]
+                report[name] = dict(totals, cached_ratio=totals["cached_tokens"] / prompt if prompt else 0.0)
+            return {"totals": report, "recent": list(self._recent)}
+
+
+usage_stats = PromptUsageStats()
+
+
+def record_gemini_usage(model, usage_metadata):
+    if usage_metadata is None:
+        return {}
+    return usage_stats.record(
+        "gemini", model,
+        getattr(usage_metadata, "prompt_token_count", 0),
+        getattr(usage_metadata, "cached_content_token_count", 0),
+        getattr(usage_metadata, "candidates_token_count", 0),
+    )
+
+
+def record_openai_usage(model, usage):
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return usage_stats.record("openai", model, usage.prompt_tokens, getattr(details, "cached_tokens", 0), usage.completion_tokens)
+
+
+def get_prompt_cache_stats():
+    return dict(usage_stats.snapshot(), gemini_cache=gemini_prompt_cache.stats())
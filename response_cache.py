@@ -0,0 +1,234 @@
+from context_builder import extract_facts
+from command_parser import parse_response, FEEDBACK_PATTERN
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+
+# --- Configuration ---
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") == "1"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(4 * 1024 * 1024)))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Minimum char-trigram cosine similarity for a near-duplicate phrasing to reuse an answer; 0 turns
+# the similarity lookup off (exact normalized matches only).
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.9"))
+NGRAM_SIZE = 3
+
+# The only words two phrasings may differ in to count as near-duplicates; any other difference
+# (a name, "si"/"no") means a different message.
+STOP_WORDS = {"a", "al", "de", "del", "el", "la", "las", "lo", "los", "un", "una", "y", "o", "e", "en", "con", "por", "para", "que", "me", "mi", "mis", "tu", "su", "favor"}
+# Capitalised words that are common in a first message and not names.
+COMMON_CAPITALISED = {"hola", "buenas", "buenos", "buen", "dia", "dias", "tardes", "noches", "gracias", "quiero", "necesito", "ayuda", "ayudame", "por", "favor", "si", "no", "mi", "me", "soy"}
+NAME_LIKE_PATTERN = re.compile(r"\b[A-ZÁÉÍÓÚÑ][a-záéíóúñü]{2,}\b")
+PERSONAL_DATA_PATTERN = re.compile(r"\d{3,}|TEL-", re.IGNORECASE)
+DIGIT_PATTERN = re.compile(r"\d")
+NON_WORD_PATTERN = re.compile(r"[^\w\s]")
+ERROR_REPLY_MARKER = "Error de comunicación con el modelo de IA"
+
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(NON_WORD_PATTERN.sub(" ", text).split())
+
+
+def state_fingerprint(messages):
+    # Where the flow is, not the data in it: the command/feedback types seen so far and the
+    # assistant's previous reply (hashed, since it can contain the user's name).
+    markers = []
+    previous_reply = ""
+    for message in messages[:-1]:
+        content = message["content"]
+        command = parse_response(content) if message["role"] == "assistant" else None
+        feedback = FEEDBACK_PATTERN.match(content) if message["role"] == "user" else None
+        if command is not None and command.is_command:
+            markers.append(command.name)
+        elif feedback:
+            markers.append(feedback.group(0))
+        elif message["role"] == "assistant":
+            previous_reply = normalize_text(content)
+    return hashlib.sha256("|".join(markers + [previous_reply]).encode("utf-8")).hexdigest()[:24]
+
+
+def _ngrams(text):
+    padded = f" {text} "
+    counts = defaultdict(int)
+    for i in range(len(padded) - NGRAM_SIZE + 1):
+        counts[padded[i:i + NGRAM_SIZE]] += 1
+    return counts
+
+
+def _cosine(a, b):
+    dot = sum(count * b.get(gram, 0) for gram, count in a.items())
+    if not dot:
+        return 0.0
+    norm = (sum(c * c for c in a.values()) * sum(c * c for c in b.values())) ** 0.5
+    return dot / norm
+
+
+def _content_words(text):
+    return set(text.split()) - STOP_WORDS
+
+
+def _personal_names(messages, facts):
+    # Validated name from the facts, plus name-like words the user typed in the last message
+    # (e.g. "soy Carlos Rojas"), which the model may echo before anything is validated.
+    name = extract_facts(messages, facts).get("name") or ""
+    names = [part for part in normalize_text(name).split() if len(part) > 2]
+    if messages and messages[-1]["role"] == "user":
+        typed = (normalize_text(word) for word in NAME_LIKE_PATTERN.findall(messages[-1]["content"]))
+        names.extend(word for word in typed if word not in COMMON_CAPITALISED)
+    return names
+
+
+def is_cacheable_response(response, messages, facts=None):
+    # Commands carry phones/documents and trigger backend actions; errors are transient.
+    if not response or parse_response(response).is_command or ERROR_REPLY_MARKER in response:
+        return False
+    if PERSONAL_DATA_PATTERN.search(response):
+        return False
+    normalized = normalize_text(response)
+    return not any(re.search(rf"\b{re.escape(part)}\b", normalized) for part in _personal_names(messages, facts))
+
+
+class ResponseCache:
+    # LRU + TTL cache of conversational replies, bounded by entries and by approximate bytes.
+    # Shared by every session of the process; keys and values never hold personal data.
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 ttl=RESPONSE_CACHE_TTL_SECONDS, similarity=RESPONSE_CACHE_SIMILARITY, enabled=RESPONSE_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.similarity = similarity
+        self.enabled = enabled
+        self._entries = OrderedDict()  # key -> entry dict
+        self._buckets = defaultdict(set)  # (provider, model, fingerprint) -> keys, for similarity lookups
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.stores = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+    def key_for(self, provider, model, messages):
+        # Only turns whose expected output is a conversational reply: backend OK_*/ERROR_* feedback
+        # and the opening message (ESTADO 1). Anything else the user types may be the step where
+        # the flow expects a command (e.g. "Sí, confirmo" -> GENERAR_TICKET), so it's never cached.
+        # None also when the last message holds digits (phone, document) or validated data.
+        if not self.enabled or not messages:
+            return None
+        last = messages[-1]["content"]
+        is_feedback = messages[-1]["role"] == "user" and FEEDBACK_PATTERN.match(last)
+        is_opening = not any(message["role"] == "assistant" for message in messages[:-1])
+        if not (is_feedback or is_opening):
+            return None
+        if DIGIT_PATTERN.search(last) or last.startswith("OK_TELCOID"):
+            return None
+        return (provider, model, state_fingerprint(messages), normalize_text(last))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._buckets[key[:3]].discard(key)
+        if not self._buckets[key[:3]]:
+            del self._buckets[key[:3]]
+        self._bytes -= entry["size"]
+
+    def _similar(self, key, now):
+        if self.similarity <= 0:
+            return None
+        grams = _ngrams(key[3])
+        words = _content_words(key[3])
+        best, best_score = None, self.similarity
+        for candidate in self._buckets.get(key[:3], ()):
+            entry = self._entries[candidate]
+            if entry["expires_at"] <= now or _content_words(candidate[3]) != words:
+                continue
+            score = _cosine(grams, entry["ngrams"])
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def get(self, key):
+        if key is None:
+            with self._lock:
+                self.skipped += 1
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] <= now:
+                self._remove(key)
+                entry = None
+            similar = False
+            if entry is None:
+                match = self._similar(key, now)
+                if match is None:
+                    self.misses += 1
+                    return None
+                key, entry, similar = match, self._entries[match], True
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.similar_hits += similar
+            self.saved_seconds += entry["latency"]
+            return entry["response"]
+
+    def set(self, key, response, latency, messages, facts=None):
+        if key is None or not is_cacheable_response(response, messages, facts):
+            return False
+        size = len(response.encode("utf-8")) + len(key[3].encode("utf-8")) + 200
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                "response": response,
+                "ngrams": _ngrams(key[3]),
+                "latency": latency,
+                "size": size,
+                "expires_at": time.monotonic() + self.ttl,
+            }
+            self._buckets[key[:3]].add(key)
+            self._bytes += size
+            self.stores += 1
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "skipped": self.skipped,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_latency_s": round(self.saved_seconds, 3),
+            }
+
+
+response_cache = ResponseCache()
+
+
+def get_response_cache_stats():
+    return response_cache.stats()
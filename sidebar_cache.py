@@ -0,0 +1,76 @@
+from chat_utils import get_user_conversations, get_tickets_by_conversation, load_conversation
+from ttl_cache import data_versions
+
+
+class SidebarCache:
+    # Per-session copy of the conversation list and ticket panels, kept in st.session_state.
+    # Each entry stores the data_versions it was read at; ordinary reruns compare versions
+    # (no DB round-trip) and only refetch after one of the mutating chat_utils helpers ran.
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self._conversations = None
+        self._list_version = None  # (session version, {conversation_id: version})
+        self._tickets = {}  # conversation_id -> (version, tickets)
+        self.hits = 0
+        self.fetches = 0
+
+    # --- Conversations ---
+    def _snapshot(self, conversations):
+        return data_versions.get("session", self.session_id), {c["id"]: data_versions.get("conversation", c["id"]) for c in conversations}
+
+    def conversations(self):
+        if self._conversations is not None and self._snapshot(self._conversations) == self._list_version:
+            self.hits += 1
+            return self._conversations
+        self.fetches += 1
+        session_version = data_versions.get("session", self.session_id)
+        conversations = get_user_conversations(self.session_id)
+        # Versions are read before the fetch, so a mutation racing with it forces another refetch.
+        self._conversations = conversations
+        self._list_version = (session_version, {c["id"]: data_versions.get("conversation", c["id"]) for c in conversations})
+        return self._conversations
+
+    def add_conversation(self, conversation):
+        if self._conversations is None:
+            return
+        self._conversations.insert(0, conversation)
+        self._list_version = self._snapshot(self._conversations)
+
+    def remove_conversation(self, conversation_id):
+        # In-place update after a delete instead of refetching the whole list.
+        self._tickets.pop(conversation_id, None)
+        if self._conversations is None:
+            return
+        self._conversations[:] = [c for c in self._conversations if c["id"] != conversation_id]
+        self._list_version = self._snapshot(self._conversations)
+
+    def rename_conversation(self, conversation_id, title):
+        if self._conversations is None:
+            return
+        for conversation in self._conversations:
+            if conversation["id"] == conversation_id:
+                conversation["title"] = title
+        self._list_version = self._snapshot(self._conversations)
+
+    # --- Tickets ---
+    def tickets(self, conversation_id):
+        version = data_versions.get("tickets", conversation_id)
+        cached = self._tickets.get(conversation_id)
+        if cached and cached[0] == version:
+            self.hits += 1
+            return cached[1]
+        self.fetches += 1
+        tickets = get_tickets_by_conversation(conversation_id)
+        self._tickets[conversation_id] = (version, tickets)
+        return tickets
+
+    def load_conversation(self, conversation_id):
+        # First load of a conversation: messages and tickets in one concurrent fetch.
+        version = data_versions.get("tickets", conversation_id)
+        messages, has_more, tickets = load_conversation(conversation_id)
+        self._tickets[conversation_id] = (version, tickets)
+        return messages, has_more
+
+    def stats(self):
+        total = self.hits + self.fetches
+        return {"hits": self.hits, "fetches": self.fetches, "hit_rate": self.hits / total if total else 0.0}
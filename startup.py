@@ -0,0 +1,117 @@
+import functools
+import importlib
+import json
+import logging
+import sys
+import threading
+import time
+
+# Imported first by main.py, so this is as close to the process start as the app can measure.
+PROCESS_START = time.perf_counter()
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    # Cold-start timings: import time per module, shared resource creation and the first request
+    # of each kind. Logged once when the first page render finishes.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.imports = {}
+        self.resources = {}
+        self.first_requests = {}
+        self.ready_ms = None
+
+    def record_import(self, name, seconds):
+        with self._lock:
+            self.imports.setdefault(name, round(seconds * 1000, 2))
+
+    def record_resource(self, name, seconds):
+        with self._lock:
+            self.resources[name] = round(seconds * 1000, 2)
+
+    def record_first_request(self, name, seconds):
+        with self._lock:
+            self.first_requests.setdefault(name, round(seconds * 1000, 2))
+
+    def import_module(self, name):
+        # Like importlib.import_module, timing only the first (real) import of the module.
+        if name in sys.modules:
+            return sys.modules[name]
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        self.record_import(name, time.perf_counter() - start)
+        return module
+
+    def mark_ready(self):
+        with self._lock:
+            if self.ready_ms is not None:
+                return
+            self.ready_ms = round((time.perf_counter() - PROCESS_START) * 1000, 2)
+        logger.info(f"Arranque: {json.dumps(self.snapshot(), ensure_ascii=False)}")
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "ready_ms": self.ready_ms,
+                "imports_ms": dict(self.imports),
+                "resources_ms": dict(self.resources),
+                "first_requests_ms": dict(self.first_requests),
+            }
+
+
+startup_report = StartupReport()
+
+
+class _ImportTimer:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            startup_report.record_import(self.name, time.perf_counter() - self._start)
+        return False
+
+
+def timed_import(name):
+    # Usage: with timed_import("chat_utils"): from chat_utils import ...
+    return _ImportTimer(name)
+
+
+def lazy_import(name):
+    # Provider SDKs are imported on first use, so a session only pays for the one it picks.
+    return startup_report.import_module(name)
+
+
+def cached_resource(name):
+    # Process-wide, thread-safe lazy singleton. Failures aren't cached: the next call retries.
+    def decorator(factory):
+        lock = threading.Lock()
+        instance = []
+
+        @functools.wraps(factory)
+        def get():
+            if instance:
+                return instance[0]
+            with lock:
+                if not instance:
+                    start = time.perf_counter()
+                    instance.append(factory())
+                    startup_report.record_resource(name, time.perf_counter() - start)
+            return instance[0]
+
+        def reset():
+            with lock:
+                instance.clear()
+
+        get.reset = reset
+        return get
+    return decorator
+
+
+def get_startup_report():
+    return startup_report.snapshot()
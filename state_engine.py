@@ -0,0 +1,206 @@
+from command_parser import parse_response, TELCOID_OK_PATTERN, TICKET_OK_PATTERN
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+# --- States (mirror the ESTADO N blocks of SYSTEM_PROMPT) ---
+INICIO_CONVERSACION = "INICIO_CONVERSACION"
+ESPERANDO_TELEFONO = "ESPERANDO_TELEFONO"
+ESPERANDO_DIGITOS_DOCUMENTO = "ESPERANDO_DIGITOS_DOCUMENTO"
+ESPERANDO_CONFIRMACION_FINAL = "ESPERANDO_CONFIRMACION_FINAL"
+FLUJO_COMPLETADO = "FLUJO_COMPLETADO"
+# Used for conversations loaded from the DB: the backend feedback isn't persisted,
+# so the state can't be rebuilt and every turn goes to the LLM until it re-syncs.
+ESTADO_DESCONOCIDO = "ESTADO_DESCONOCIDO"
+
+# --- Templated replies (copied verbatim from SYSTEM_PROMPT) ---
+REPLY_ASK_PHONE = "Entendido. Para poder ayudarte a bloquear tu línea, necesito primero el número de teléfono de 10 dígitos que deseas bloquear. Por favor, facilítame ese dato."
+REPLY_TELCOID_OK = "¡Perfecto, {name}! Hemos verificado tu número. Para continuar con la seguridad, por favor, indícame los últimos 3 dígitos de tu documento de identidad."
+REPLY_TELCOID_ERROR = "Lo siento, no he podido encontrar el número de teléfono que me indicaste. ¿Podrías verificarlo y escribirlo de nuevo, por favor?"
+REPLY_VALIDATION_OK = "¡Validación exitosa! Tu identidad ha sido confirmada. ¿Deseas proceder con el bloqueo **definitivo** de tu línea? Esta acción no se puede deshacer."
+REPLY_VALIDATION_ERROR = "Los dígitos del documento no coinciden. Por tu seguridad, no podemos continuar. Podemos intentar de nuevo, por favor, envíame los 3 dígitos correctos."
+REPLY_TICKET_OK = "Hecho. La línea ha sido bloqueada exitosamente. Tu número de ticket de soporte es **{ticket}**. Por favor, guárdalo para futuras referencias. Ha sido un placer ayudarte."
+REPLY_TICKET_ERROR = "Lo siento, ha ocurrido un error inesperado al intentar generar el bloqueo. Por favor, intenta de nuevo en unos minutos o contacta a soporte directamente."
+
+# --- Extraction rules ---
+PHONE_PATTERN = re.compile(r"(?<!\d)(\d{10})(?!\d)")
+DIGITS_PATTERN = re.compile(r"(?<!\d)(\d{3})(?!\d)")
+ANY_DIGITS_PATTERN = re.compile(r"\d+")
+WORD_PATTERN = re.compile(r"[a-z]+")
+
+BLOCK_INTENT_WORDS = {"bloquear", "bloqueo", "bloquea", "bloqueen", "robo", "robaron", "robado", "perdi", "perdida", "perdido", "extravie", "extraviado"}
+CONFIRM_WORDS = {"si", "confirmo", "confirmar", "proceder", "procede", "procedan", "adelante", "acepto", "claro", "dale", "ok", "listo", "hazlo"}
+NEGATION_WORDS = {"no", "cancelar", "cancela", "espera", "esperar", "nunca", "tampoco", "pero", "duda"}
+QUESTION_MARKS = ("?", "¿")
+
+
+def _normalize(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _words(text):
+    return set(WORD_PATTERN.findall(_normalize(text)))
+
+
+def wrap_reply(text):
+    return f"<respuesta_conversacional>{text}</respuesta_conversacional>"
+
+
+def wrap_command(command):
+    return f"<comando_interno>{command}</comando_interno>"
+
+
+# --- Fast-path metrics (process-wide, shared across sessions) ---
+class FastPathMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: {"fast_path": 0, "fallback": 0})
+
+    def record(self, state, fast_path):
+        with self._lock:
+            self._counts[state]["fast_path" if fast_path else "fallback"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            report = {}
+            for state, counts in self._counts.items():
+                total = counts["fast_path"] + counts["fallback"]
+                report[state] = dict(counts, total=total, fast_path_rate=counts["fast_path"] / total if total else 0.0)
+            return report
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+fast_path_metrics = FastPathMetrics()
+
+
+def get_fast_path_metrics():
+    return fast_path_metrics.snapshot()
+
+
+class FlowState:
+    def __init__(self, state=INICIO_CONVERSACION):
+        self.state = state
+        self.phone = None
+        self.document = None
+        self.name = None
+
+    @classmethod
+    def for_history(cls, messages):
+        return cls(INICIO_CONVERSACION if not messages else ESTADO_DESCONOCIDO)
+
+    def facts(self):
+        return {"phone": self.phone, "document": self.document, "name": self.name}
+
+    # Keeps the local state in sync with commands issued through the LLM path.
+    def observe(self, llm_response, system_feedback):
+        parsed = parse_response(llm_response)
+        if not parsed.is_command or not system_feedback:
+            return
+        name = parsed.name
+        if name == "VALIDAR_TELCOID":
+            phone_match = PHONE_PATTERN.search(parsed.command)
+            self._apply_telcoid(phone_match.group(1) if phone_match else None, system_feedback)
+        elif name == "VALIDAR_DOCUMENTO":
+            self._apply_document(system_feedback)
+        elif name == "GENERAR_TICKET":
+            self._apply_ticket(system_feedback)
+
+    def _apply_telcoid(self, phone, feedback):
+        ok_match = TELCOID_OK_PATTERN.match(feedback)
+        if ok_match and phone:
+            self.phone = phone
+            self.document = ok_match.group(1).strip()
+            self.name = ok_match.group(2).strip()
+            self.state = ESPERANDO_DIGITOS_DOCUMENTO
+            return REPLY_TELCOID_OK.format(name=self.name)
+        self.state = ESPERANDO_TELEFONO
+        return REPLY_TELCOID_ERROR
+
+    def _apply_document(self, feedback):
+        if feedback.startswith("OK_VALIDACION"):
+            self.state = ESPERANDO_CONFIRMACION_FINAL
+            return REPLY_VALIDATION_OK
+        if self.phone:
+            self.state = ESPERANDO_DIGITOS_DOCUMENTO
+        return REPLY_VALIDATION_ERROR
+
+    def _apply_ticket(self, feedback):
+        ok_match = TICKET_OK_PATTERN.match(feedback)
+        if ok_match:
+            self.state = FLUJO_COMPLETADO
+            return REPLY_TICKET_OK.format(ticket=ok_match.group(1))
+        return REPLY_TICKET_ERROR
+
+
+class FastPathResult:
+    def __init__(self, reply, command=None, system_feedback=None):
+        self.reply = reply
+        self.command = command
+        self.system_feedback = system_feedback
+
+
+# --- Rule-based classifiers; each returns None when the input is ambiguous ---
+def extract_phone(text):
+    phones = set(PHONE_PATTERN.findall(text))
+    other_numbers = [n for n in ANY_DIGITS_PATTERN.findall(text) if len(n) != 10]
+    if len(phones) == 1 and not other_numbers:
+        return phones.pop()
+    return None
+
+
+def extract_document_digits(text):
+    numbers = ANY_DIGITS_PATTERN.findall(text)
+    if len(numbers) == 1 and DIGITS_PATTERN.fullmatch(numbers[0]):
+        return numbers[0]
+    return None
+
+
+def is_confirmation(text):
+    if any(mark in text for mark in QUESTION_MARKS):
+        return False
+    words = _words(text)
+    return bool(words & CONFIRM_WORDS) and not (words & NEGATION_WORDS)
+
+
+def is_block_intent(text):
+    if any(mark in text for mark in QUESTION_MARKS) or ANY_DIGITS_PATTERN.search(text):
+        return False
+    words = _words(text)
+    return bool(words & BLOCK_INTENT_WORDS) and not (words & NEGATION_WORDS)
+
+
+def run_fast_path(flow, user_text, conversation_id, execute_command):
+    # execute_command is process_llm_command (injected to keep this module free of backend imports).
+    state = flow.state
+    result = None
+
+    if state in (INICIO_CONVERSACION, ESPERANDO_TELEFONO):
+        phone = extract_phone(user_text)
+        if phone:
+            command = wrap_command(f"VALIDAR_TELCOID:{phone}")
+            feedback = execute_command(command, conversation_id)
+            result = FastPathResult(wrap_reply(flow._apply_telcoid(phone, feedback)), command, feedback)
+        elif state == INICIO_CONVERSACION and is_block_intent(user_text):
+            flow.state = ESPERANDO_TELEFONO
+            result = FastPathResult(wrap_reply(REPLY_ASK_PHONE))
+
+    elif state == ESPERANDO_DIGITOS_DOCUMENTO and flow.phone:
+        digits = extract_document_digits(user_text)
+        if digits:
+            command = wrap_command(f"VALIDAR_DOCUMENTO:{flow.phone}:{digits}")
+            feedback = execute_command(command, conversation_id)
+            result = FastPathResult(wrap_reply(flow._apply_document(feedback)), command, feedback)
+
+    elif state == ESPERANDO_CONFIRMACION_FINAL and flow.phone and flow.document and flow.name:
+        if is_confirmation(user_text):
+            command = wrap_command(f"GENERAR_TICKET:{flow.phone}:{flow.document}:{flow.name}:perdida")
+            feedback = execute_command(command, conversation_id)
+            result = FastPathResult(wrap_reply(flow._apply_ticket(feedback)), command, feedback)
+
+    fast_path_metrics.record(state, result is not None)
+    return result
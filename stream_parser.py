@@ -0,0 +1,111 @@
+# Tags and the whole-response parser live in command_parser; this module only handles the stream.
+from command_parser import OPEN_CONVERSATIONAL, CLOSE_CONVERSATIONAL, OPEN_COMMAND, CLOSE_COMMAND
+
+MODE_PENDING = "pending"
+MODE_CONVERSATIONAL = "conversational"
+MODE_COMMAND = "command"
+MODE_PLAIN = "plain"
+
+
+def _partial_suffix_length(text, tag):
+    # Length of the longest suffix of text that could still grow into tag.
+    for size in range(min(len(text), len(tag) - 1), 0, -1):
+        if tag.startswith(text[-size:]):
+            return size
+    return 0
+
+
+class StreamingResponseParser:
+    def __init__(self):
+        self.raw_text = ""
+        self.mode = MODE_PENDING
+        self.display_text = ""
+        self.command_complete = False
+        self.finished = False
+        self._content_start = 0
+
+    @property
+    def is_command(self):
+        return self.mode == MODE_COMMAND
+
+    @property
+    def command_response(self):
+        # The raw response trimmed right after the closing tag, as process_llm_command expects it.
+        end = self.raw_text.find(CLOSE_COMMAND)
+        return self.raw_text[:end + len(CLOSE_COMMAND)] if end != -1 else self.raw_text
+
+    def feed(self, chunk):
+        # Keeps reading after a conversational block closes: a command may still follow it.
+        if not chunk or self.command_complete:
+            return ""
+        self.raw_text += chunk
+        if self.mode == MODE_PENDING:
+            self._detect_mode()
+        if self.mode in (MODE_CONVERSATIONAL, MODE_PLAIN):
+            self._detect_command()
+        if self.mode == MODE_COMMAND:
+            if CLOSE_COMMAND in self.raw_text[self._content_start:]:
+                self.command_complete = True
+                self.finished = True
+            return ""
+        if self.mode in (MODE_CONVERSATIONAL, MODE_PLAIN) and not self.finished:
+            return self._emit(final=False)
+        return ""
+
+    def close(self):
+        # Flushes whatever was held back once the stream has ended.
+        if self.mode == MODE_PENDING:
+            self.mode = MODE_PLAIN
+            self._content_start = 0
+            self._detect_command()
+        if self.mode == MODE_COMMAND or self.finished:
+            self.finished = True
+            return ""
+        delta = self._emit(final=True)
+        self.finished = True
+        return delta
+
+    def _detect_command(self):
+        # A command can come after text ("Claro <comando_interno>..."): nothing from its opening
+        # tag on is shown, and the response is handled as a command.
+        index = self.raw_text.find(OPEN_COMMAND, self._content_start)
+        if index != -1:
+            self.mode = MODE_COMMAND
+            self._content_start = index + len(OPEN_COMMAND)
+
+    def _detect_mode(self):
+        stripped = self.raw_text.lstrip()
+        offset = len(self.raw_text) - len(stripped)
+        if stripped.startswith(OPEN_CONVERSATIONAL):
+            self.mode = MODE_CONVERSATIONAL
+            self._content_start = offset + len(OPEN_CONVERSATIONAL)
+        elif stripped.startswith(OPEN_COMMAND):
+            self.mode = MODE_COMMAND
+            self._content_start = offset + len(OPEN_COMMAND)
+        elif not stripped or OPEN_CONVERSATIONAL.startswith(stripped) or OPEN_COMMAND.startswith(stripped):
+            return  # Not enough text yet to tell which tag is coming.
+        else:
+            # Untagged output: shown as-is, same fallback as extract_conversational_response.
+            self.mode = MODE_PLAIN
+            self._content_start = 0
+
+    def _emit(self, final):
+        content = self.raw_text[self._content_start:]
+        if self.mode == MODE_CONVERSATIONAL:
+            close_index = content.find(CLOSE_CONVERSATIONAL)
+            if close_index != -1:
+                content = content[:close_index]
+                self.finished = True
+            elif not final:
+                content = content[:len(content) - _partial_suffix_length(content, CLOSE_CONVERSATIONAL)]
+        if not final and not self.finished:
+            # Held back while it could still be the start of a command tag.
+            content = content[:len(content) - _partial_suffix_length(content, OPEN_COMMAND)]
+        content = content.strip() if (final or self.finished) else content.lstrip()
+        if not content.startswith(self.display_text):
+            # Trailing whitespace was trimmed after being shown; nothing new to add.
+            self.display_text = content
+            return ""
+        delta = content[len(self.display_text):]
+        self.display_text = content
+        return delta
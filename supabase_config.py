@@ -1,4 +1,5 @@
-from supabase import create_client, Client
+from startup import cached_resource, lazy_import
+import logging
 import os
 from dotenv import load_dotenv
 
@@ -7,8 +8,19 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-try:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-except Exception as e:
-    print(f"Error al inicializar Supabase client: {e}")
-    supabase = None 
\ No newline at end of file
+logger = logging.getLogger(__name__)
+
+
+@cached_resource("supabase")
+def get_supabase():
+    # Created on first use and shared by the whole process (every Streamlit session); importing
+    # this module no longer opens a client.
+    try:
+        return lazy_import("supabase").create_client(SUPABASE_URL, SUPABASE_KEY)
+    except Exception as e:
+        logger.error(f"Error al inicializar Supabase client: {e}")
+        raise
+
+async def create_async_supabase():
+    # The async client is bound to the event loop it's created on, so callers create it inside their loop.
+    return await lazy_import("supabase").acreate_client(SUPABASE_URL, SUPABASE_KEY)
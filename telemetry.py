@@ -0,0 +1,227 @@
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+
+# --- Configuration ---
+TRACING_ENABLED = os.getenv("TELCOBOT_TRACING", "0") == "1"
+TRACE_FILE = os.getenv("TELCOBOT_TRACE_FILE", "")
+HISTOGRAM_SAMPLE_SIZE = int(os.getenv("TELCOBOT_TRACE_SAMPLES", "1000"))
+
+# Document numbers, phones and ticket suffixes: keep only the last 3 digits.
+LONG_NUMBER_PATTERN = re.compile(r"\d{4,}")
+NAME_PATTERN = re.compile(r"(NOMBRE:)[^:|\n<]*")
+TICKET_COMMAND_PATTERN = re.compile(r"(GENERAR_TICKET\s*:[^:]*:[^:]*:)[^:<]*")
+
+_current_span = contextvars.ContextVar("telcobot_span", default=None)
+
+
+def mask_number(value):
+    value = str(value)
+    return "*" * max(len(value) - 3, 0) + value[-3:]
+
+
+def redact(text, name=None):
+    # Masks personal data in free text (commands, backend feedback, replies) before it's logged or
+    # exported. name: a known person's name (e.g. the validated one) whose words are masked too.
+    if not isinstance(text, str):
+        return text
+    text = TICKET_COMMAND_PATTERN.sub(r"\1***", text)
+    text = NAME_PATTERN.sub(r"\1***", text)
+    for part in str(name or "").split():
+        if len(part) > 2:
+            text = re.sub(rf"\b{re.escape(part)}\b", "***", text, flags=re.IGNORECASE)
+    return LONG_NUMBER_PATTERN.sub(lambda m: mask_number(m.group(0)), text)
+
+
+def _attribute(key, value):
+    # Ids (conversation_id, ...) are kept as they are so traces can be tied to them; masking
+    # digit runs would mangle UUIDs. Everything else may be free text.
+    return value if key.endswith("_id") else redact(value)
+
+
+class Span:
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "attributes", "start_time", "duration_ms", "error", "_start", "_token")
+
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = {k: _attribute(k, v) for k, v in attributes.items()}
+        self.start_time = None
+        self.duration_ms = None
+        self.error = None
+        self._start = None
+        self._token = None
+
+    def set(self, **attributes):
+        for key, value in attributes.items():
+            self.attributes[key] = _attribute(key, value)
+        return self
+
+    def elapsed_ms(self):
+        return (time.perf_counter() - self._start) * 1000 if self._start else 0.0
+
+    # start()/finish() don't make the span current; used for spans that outlive the caller's
+    # frame, like a streaming generator.
+    def start(self):
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def finish(self, error=None):
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = round(self.elapsed_ms(), 3)
+        if error is not None:
+            self.error = f"{type(error).__name__}: {redact(str(error))}"
+        self.tracer._export(self)
+
+    def __enter__(self):
+        self.start()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        self.finish(exc)
+        return False
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": self.duration_ms,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    # Returned when tracing is off: every call is a no-op, so instrumented code pays almost nothing.
+    def set(self, **attributes):
+        return self
+
+    def elapsed_ms(self):
+        return 0.0
+
+    def start(self):
+        return self
+
+    def finish(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class JsonLinesExporter:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class HistogramExporter:
+    # In-process latency summary per span name (bounded sample per name).
+    def __init__(self, sample_size=HISTOGRAM_SAMPLE_SIZE):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=sample_size))
+        self._counts = defaultdict(int)
+        self._errors = defaultdict(int)
+
+    def export(self, span):
+        with self._lock:
+            self._samples[span.name].append(span.duration_ms)
+            self._counts[span.name] += 1
+            if span.error:
+                self._errors[span.name] += 1
+
+    def summary(self):
+        with self._lock:
+            report = {}
+            for name, samples in self._samples.items():
+                ordered = sorted(samples)
+                pick = lambda q: ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+                report[name] = {
+                    "count": self._counts[name],
+                    "errors": self._errors[name],
+                    "p50_ms": pick(0.50),
+                    "p95_ms": pick(0.95),
+                    "p99_ms": pick(0.99),
+                    "max_ms": ordered[-1],
+                }
+            return report
+
+
+class Tracer:
+    def __init__(self, enabled=TRACING_ENABLED):
+        self.enabled = enabled
+        self.exporters = []
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+        return exporter
+
+    def span(self, name, **attributes):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, _current_span.get(), attributes)
+
+    def _export(self, span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception:
+                pass  # Telemetry must never break a turn.
+
+
+tracer = Tracer()
+histogram = tracer.add_exporter(HistogramExporter())
+if TRACE_FILE:
+    tracer.add_exporter(JsonLinesExporter(TRACE_FILE))
+
+
+def span(name, **attributes):
+    return tracer.span(name, **attributes)
+
+
+def db_span(table, op, **attributes):
+    return tracer.span("db", table=table, op=op, **attributes)
+
+
+def bind_current_span(coro):
+    # Coroutines scheduled on another thread's event loop don't inherit contextvars; this carries
+    # the caller's span over so DB spans nest under the turn.
+    parent = _current_span.get()
+    if parent is None:
+        return coro
+
+    async def with_parent():
+        _current_span.set(parent)
+        return await coro
+    return with_parent()
+
+
+def get_trace_summary():
+    return histogram.summary() if tracer.enabled else {}
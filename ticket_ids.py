@@ -0,0 +1,107 @@
+from supabase_config import get_supabase
+import datetime
+import logging
+import os
+import threading
+import time
+
+# --- Configuration ---
+# 41 bits of milliseconds since EPOCH_MS, 10 bits of node, 12 bits of per-millisecond sequence
+# (same layout as a Snowflake ID): unique across processes as long as node ids differ.
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+TICKET_PREFIX = "TEL"
+# SQL function returning nextval() of a cycling 0..1023 sequence (see README).
+NODE_LEASE_RPC = "allocate_ticket_node"
+BASE36_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+logger = logging.getLogger(__name__)
+
+
+def _configured_node_id():
+    configured = os.getenv("TICKET_NODE_ID")
+    return int(configured) if configured else None
+
+
+def lease_node_id():
+    # Without TICKET_NODE_ID each process takes the next value of a DB sequence, so concurrently
+    # running processes get different nodes. Errors propagate: no ids without a node.
+    node_id = get_supabase().rpc(NODE_LEASE_RPC).execute().data
+    node_id = int(node_id[0] if isinstance(node_id, list) else node_id)
+    logger.info(f"Nodo de tickets asignado por la base de datos: {node_id}")
+    return node_id
+
+
+def _base36(value):
+    digits = []
+    while value:
+        value, remainder = divmod(value, 36)
+        digits.append(BASE36_ALPHABET[remainder])
+    return "".join(reversed(digits)) or "0"
+
+
+class TicketIdAllocator:
+    # node_id is resolved on first use: the explicit value, else TICKET_NODE_ID, else node_source
+    # (a DB lease). Without any of them no id is issued rather than risking duplicates.
+    def __init__(self, node_id=None, clock=time.time, node_source=None):
+        self._node_id = node_id
+        self._node_source = node_source
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    @property
+    def node_id(self):
+        with self._lock:
+            return self._resolve_node()
+
+    def _resolve_node(self):
+        # Caller holds the lock. A failed lookup isn't remembered: the next call retries it.
+        if self._node_id is None:
+            node_id = _configured_node_id()
+            if node_id is None:
+                if self._node_source is None:
+                    raise RuntimeError("TICKET_NODE_ID no está configurado y no hay asignación de nodo disponible.")
+                node_id = self._node_source()
+            if not 0 <= node_id <= MAX_NODE_ID:
+                raise ValueError(f"TICKET_NODE_ID debe estar entre 0 y {MAX_NODE_ID}.")
+            self._node_id = node_id
+        return self._node_id
+
+    def _now_ms(self):
+        return int(self._clock() * 1000) - EPOCH_MS
+
+    def _next_raw(self):
+        # Caller holds the lock. If the wall clock goes backwards or the sequence of the current
+        # millisecond is exhausted, keep counting on the last millisecond instead of waiting.
+        node_id = self._resolve_node()
+        now = self._now_ms()
+        if now > self._last_ms:
+            self._last_ms, self._sequence = now, 0
+        elif self._sequence < MAX_SEQUENCE:
+            self._sequence += 1
+        else:
+            self._last_ms, self._sequence = self._last_ms + 1, 0
+        return (self._last_ms << (NODE_BITS + SEQUENCE_BITS)) | (node_id << SEQUENCE_BITS) | self._sequence
+
+    def _format(self, raw):
+        day = datetime.datetime.fromtimestamp((EPOCH_MS + (raw >> (NODE_BITS + SEQUENCE_BITS))) / 1000, datetime.timezone.utc)
+        return f"{TICKET_PREFIX}-{day.strftime('%Y%m%d')}-{_base36(raw)}"
+
+    def next_id(self):
+        with self._lock:
+            raw = self._next_raw()
+        return self._format(raw)
+
+    def next_batch(self, count):
+        # Reserves count ids under a single lock acquisition; used by bulk ticket creation.
+        with self._lock:
+            raws = [self._next_raw() for _ in range(count)]
+        return [self._format(raw) for raw in raws]
+
+
+ticket_ids = TicketIdAllocator(node_source=lease_node_id)
@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+# Keys kept by DataVersions; older ones are evicted and read as changed.
+DATA_VERSIONS_MAX_KEYS = 50000
+
+
+class TTLCache:
+    # Thread-safe LRU cache with a per-entry expiry; shared by every Streamlit session of the process.
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+class DataVersions:
+    # Version per (scope, key), bumped by the helpers that mutate that data. Session caches
+    # remember the version they were filled at and only refetch once it has moved.
+    # Versions come from one process-wide counter, so they never repeat. Keys are bounded (LRU);
+    # an evicted or forgotten key reads as the floor, which is raised past its last version, so a
+    # stale cached version can never match again.
+    def __init__(self, max_keys=DATA_VERSIONS_MAX_KEYS):
+        self.max_keys = max_keys
+        self._versions = OrderedDict()
+        self._counter = 0
+        self._floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, scope, key):
+        with self._lock:
+            return self._versions.get((scope, key), self._floor)
+
+    def bump(self, scope, key):
+        with self._lock:
+            self._counter += 1
+            self._versions[(scope, key)] = self._counter
+            self._versions.move_to_end((scope, key))
+            while len(self._versions) > self.max_keys:
+                _, evicted = self._versions.popitem(last=False)
+                self._floor = max(self._floor, evicted)
+            return self._counter
+
+    def forget(self, scope, key):
+        # For data that is gone (a deleted conversation). Versions never repeat, so the key already
+        # reads different from any version it was bumped to; the floor (every other key) stays put.
+        with self._lock:
+            self._versions.pop((scope, key), None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._versions)
+
+
+data_versions = DataVersions()